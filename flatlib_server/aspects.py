@@ -0,0 +1,134 @@
+"""
+Векторизованный поиск аспектов по массивам долгот.
+
+Вместо вложенных циклов по парам объектов и if/elif по типам аспектов
+строится матрица угловых расстояний между всеми парами сразу, и она
+сравнивается с таблицей аспектов (точный угол + орб) за один проход NumPy.
+Одна и та же функция обслуживает натальные аспекты, транзиты и синастрию,
+а также пакетные расчёты, когда долготы многих карт склеены в один массив.
+
+Порядок результатов совпадает с порядком прежних циклов: по первому
+объекту, затем по второму, затем по порядку аспектов в таблице.
+"""
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from flatlib import const
+
+# В flatlib тип аспекта равен его точному углу (CONJUNCTION = 0, SEXTILE = 60, ...)
+MINOR_ORBS = {
+    const.SEMISEXTILE: 2.0,
+    const.SEMIQUINTILE: 1.0,
+    const.SEMISQUARE: 2.0,
+    const.QUINTILE: 2.0,
+    const.SESQUIQUINTILE: 1.0,
+    const.SESQUISQUARE: 2.0,
+    const.BIQUINTILE: 2.0,
+    const.QUINCUNX: 3.0,
+}
+
+# FLATLIB_MINOR_ASPECTS=1 добавляет минорные аспекты ко всем таблицам
+USE_MINOR_ASPECTS = os.getenv("FLATLIB_MINOR_ASPECTS", "0").lower() in ("1", "true", "yes")
+
+
+class AspectTable:
+    """
+    Таблица аспектов: типы, точные углы и орбы в порядке проверки.
+
+    При first_only=True для пары объектов берётся первый подходящий аспект
+    в порядке таблицы (как break в прежних циклах).
+    """
+
+    def __init__(self, orbs: Dict[int, float], minor: bool = USE_MINOR_ASPECTS):
+        orbs = dict(orbs)
+        if minor:
+            for aspect_type, orb in MINOR_ORBS.items():
+                orbs.setdefault(aspect_type, orb)
+        self.types = list(orbs)
+        self.angles = np.array([float(t) for t in self.types])
+        self.orbs = np.array([float(o) for o in orbs.values()])
+
+
+class AspectMatches(NamedTuple):
+    """Найденные аспекты: индексы объектов, тип аспекта, расстояние и орб."""
+    i: List[int]
+    j: List[int]
+    type: List[int]
+    distance: List[float]
+    orb: List[float]
+
+
+def distance_matrix(lons1, lons2) -> np.ndarray:
+    """Угловые расстояния [0, 180] между всеми парами долгот (n x m)."""
+    lons1 = np.asarray(lons1, dtype=float)
+    lons2 = np.asarray(lons2, dtype=float)
+    distance = np.abs(lons1[:, None] - lons2[None, :])
+    return np.where(distance > 180, 360 - distance, distance)
+
+
+def find_aspects(lons1: Iterable[float], lons2: Iterable[float], table: AspectTable,
+                 mask: Optional[np.ndarray] = None, first_only: bool = True) -> AspectMatches:
+    """
+    Находит аспекты между каждой долготой lons1 и каждой долготой lons2.
+
+    mask — булева матрица n x m; пары со значением False пропускаются.
+    first_only — для пары возвращать только первый подходящий аспект таблицы.
+    """
+    distance = distance_matrix(lons1, lons2)
+    orb = np.abs(distance[:, :, None] - table.angles)
+    hits = orb <= table.orbs
+    if mask is not None:
+        hits &= mask[:, :, None]
+
+    if first_only:
+        found = hits.any(axis=2)
+        i, j = np.nonzero(found)
+        k = hits[i, j].argmax(axis=1)
+    else:
+        i, j, k = np.nonzero(hits)
+
+    types = [table.types[n] for n in k.tolist()]
+    return AspectMatches(i.tolist(), j.tolist(), types, distance[i, j].tolist(), orb[i, j, k].tolist())
+
+
+def aspect_motion(lons1: Iterable[float], speeds1: Iterable[float], lons2: Iterable[float],
+                  speeds2: Iterable[float], matches: AspectMatches):
+    """
+    Сходящийся/расходящийся аспект и время до точного для найденных пар.
+
+    Скорость изменения орба считается сразу для всех пар по скоростям
+    объектов: orb = |d - A|, где d — угловое расстояние, A — угол аспекта.
+    Аспект сходящийся, если орб уменьшается; время до точного — орб,
+    делённый на скорость его уменьшения (в сутках, линейно по текущим
+    скоростям), для расходящихся аспектов — None.
+    """
+    if not matches.i:
+        return [], []
+    i = np.asarray(matches.i)
+    j = np.asarray(matches.j)
+    separation = norm180(np.asarray(lons1, dtype=float)[i] - np.asarray(lons2, dtype=float)[j])
+    relative_speed = np.asarray(speeds1, dtype=float)[i] - np.asarray(speeds2, dtype=float)[j]
+    # В flatlib тип аспекта равен его точному углу
+    angle = np.asarray(matches.type, dtype=float)
+    orb_speed = np.sign(np.abs(separation) - angle) * np.sign(separation) * relative_speed
+
+    applying = orb_speed < 0
+    days = np.divide(np.asarray(matches.orb), -orb_speed, out=np.zeros_like(orb_speed), where=applying)
+    return applying.tolist(), [d if a else None for a, d in zip(applying.tolist(), days.tolist())]
+
+
+def norm180(value):
+    """Приводит угол к диапазону [-180, 180)."""
+    return (value + 180.0) % 360.0 - 180.0
+
+
+def upper_triangle_mask(n: int) -> np.ndarray:
+    """Маска пар i < j для аспектов внутри одной карты."""
+    return np.triu(np.ones((n, n), dtype=bool), k=1)
+
+
+def different_ids_mask(ids1: List[str], ids2: List[str]) -> np.ndarray:
+    """Маска пар с разными идентификаторами объектов (транзитное Солнце не аспектирует натальное)."""
+    return np.asarray(ids1, dtype=object)[:, None] != np.asarray(ids2, dtype=object)[None, :]
@@ -0,0 +1,12 @@
+"""
+Бенчмарки расчётов и сервера. Запускаются из каталога flatlib_server:
+
+    python -m benchmarks.bench_aspects    # find_aspects против попарного перебора
+    python -m benchmarks.bench_ephemeris  # таблица эфемерид против Swiss Ephemeris
+    python -m benchmarks.bench_micro      # этапы расчёта, с базовым результатом
+    python -m benchmarks.bench_load       # смешанная нагрузка на приложение, с базовым результатом
+    python -m benchmarks.bench_startup    # холодный старт
+
+Базовые результаты (--save-baseline) хранятся в benchmarks/baselines и в
+репозиторий не попадают: они зависят от машины.
+"""
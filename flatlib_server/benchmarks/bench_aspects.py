@@ -0,0 +1,110 @@
+"""
+Сравнение векторизованного поиска аспектов (aspects.find_aspects) с прежними
+скалярными циклами.
+
+Перед замером проверяет, что обе реализации дают одинаковый результат на
+случайных долготах, затем измеряет время для наборов объектов разного размера
+и для пакетной нагрузки (транзиты одного дня против многих натальных карт).
+
+    python -m benchmarks.bench_aspects
+"""
+import random
+import time
+
+import numpy as np
+
+from aspects import AspectTable, find_aspects, upper_triangle_mask
+from charts import NATAL_ORBS, TRANSIT_ORBS
+
+
+def legacy_pairs(lons, orbs):
+    """Прежний цикл calculate_aspects: пары i < j, первый подходящий аспект."""
+    found = []
+    for i in range(len(lons)):
+        for j in range(i + 1, len(lons)):
+            distance = abs(lons[i] - lons[j])
+            if distance > 180:
+                distance = 360 - distance
+            for aspect_type, max_orb in orbs.items():
+                orb = abs(distance - aspect_type)
+                if orb <= max_orb:
+                    found.append((i, j, aspect_type, round(distance, 4), round(orb, 4)))
+                    break
+    return found
+
+
+def legacy_cross(lons1, lons2, orbs):
+    """Прежний цикл транзитов: каждый с каждым, первый подходящий аспект."""
+    found = []
+    for i, lon1 in enumerate(lons1):
+        for j, lon2 in enumerate(lons2):
+            distance = abs(lon1 - lon2)
+            if distance > 180:
+                distance = 360 - distance
+            for aspect_type, max_orb in orbs.items():
+                orb = abs(distance - aspect_type)
+                if orb <= max_orb:
+                    found.append((i, j, aspect_type, round(orb, 2)))
+                    break
+    return found
+
+
+def vector_pairs(lons, table):
+    found = find_aspects(lons, lons, table, mask=upper_triangle_mask(len(lons)))
+    return [(i, j, t, round(d, 4), round(o, 4)) for i, j, t, d, o in zip(*found)]
+
+
+def vector_cross(lons1, lons2, table):
+    found = find_aspects(lons1, lons2, table)
+    return [(i, j, t, round(o, 2)) for i, j, t, _, o in zip(*found)]
+
+
+def timeit(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_equivalence(rng):
+    natal = AspectTable(NATAL_ORBS, minor=False)
+    transit = AspectTable(TRANSIT_ORBS, minor=False)
+    for _ in range(200):
+        lons = [rng.uniform(0, 360) for _ in range(rng.randint(0, 20))]
+        # Точные углы на границе орба тоже должны совпадать
+        lons += [0.0, 8.0, 352.0, 180.0, 60.0, 64.0]
+        assert legacy_pairs(lons, NATAL_ORBS) == vector_pairs(lons, natal)
+        other = [rng.uniform(0, 360) for _ in range(rng.randint(1, 20))]
+        assert legacy_cross(lons, other, TRANSIT_ORBS) == vector_cross(lons, other, transit)
+    print("equivalence: OK (legacy loops == find_aspects)")
+
+
+def main():
+    rng = random.Random(42)
+    check_equivalence(rng)
+
+    natal = AspectTable(NATAL_ORBS, minor=False)
+    transit = AspectTable(TRANSIT_ORBS, minor=False)
+
+    print(f"\n{'objects':>10} {'legacy, ms':>12} {'numpy, ms':>12} {'speedup':>9}")
+    for n in (13, 50, 200, 1000):
+        lons = [rng.uniform(0, 360) for _ in range(n)]
+        repeat = 5 if n < 1000 else 1
+        t_legacy = timeit(legacy_pairs, lons, NATAL_ORBS, repeat=repeat)
+        t_vector = timeit(vector_pairs, lons, natal, repeat=repeat)
+        print(f"{n:>10} {t_legacy * 1e3:>12.3f} {t_vector * 1e3:>12.3f} {t_legacy / t_vector:>8.1f}x")
+
+    print(f"\n{'profiles':>10} {'legacy, ms':>12} {'numpy, ms':>12} {'speedup':>9}   (11 transit x 11 natal objects each)")
+    transit_lons = [rng.uniform(0, 360) for _ in range(11)]
+    for profiles in (10, 100, 1000):
+        natal_lons = [rng.uniform(0, 360) for _ in range(11 * profiles)]
+        t_legacy = timeit(legacy_cross, transit_lons, natal_lons, TRANSIT_ORBS, repeat=3)
+        t_vector = timeit(vector_cross, transit_lons, natal_lons, transit, repeat=3)
+        print(f"{profiles:>10} {t_legacy * 1e3:>12.3f} {t_vector * 1e3:>12.3f} {t_legacy / t_vector:>8.1f}x")
+
+
+if __name__ == "__main__":
+    np.seterr(all="raise")
+    main()
@@ -0,0 +1,66 @@
+"""
+Сравнение таблицы эфемерид (ephemeris.py) с прямыми вызовами swisseph.
+
+Нужна собранная таблица (python ephemeris.py). Измеряет одиночные запросы
+положения (как в уточнении корней при сканировании), векторный запрос по
+сетке моментов и сканирование транзитов за год.
+
+    python -m benchmarks.bench_ephemeris
+"""
+import time
+
+import numpy as np
+
+import flatlib  # noqa: F401 — задаёт путь к файлам эфемерид Swiss Ephemeris
+import ephemeris
+from charts import PLANET_IDS, compute_natal, transit_jd
+from scan import compute_transit_period
+
+NATAL = {'date': '1990/05/03', 'time': '13:20:00', 'tz': '+03:00', 'lat': 56.2575, 'lon': 43.9824}
+
+
+def timeit(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def scalar_lookups(position, jds):
+    for obj_id in PLANET_IDS:
+        for jd in jds:
+            position(obj_id, jd)
+
+
+def vector_lookups(jds):
+    for obj_id in PLANET_IDS:
+        ephemeris.body_positions(obj_id, jds)
+
+
+def main():
+    table = ephemeris.get_table()
+    if table is None:
+        raise SystemExit(f"Ephemeris table not found at {ephemeris.TABLE_PATH}, run `python ephemeris.py` first")
+
+    jds = np.random.default_rng(0).uniform(2451545.0, 2470000.0, 10000)
+    calls = len(jds) * len(PLANET_IDS)
+    t_live = timeit(scalar_lookups, ephemeris.live_position, jds.tolist(), repeat=3)
+    t_table = timeit(scalar_lookups, ephemeris.body_position, jds.tolist(), repeat=3)
+    t_vector = timeit(vector_lookups, jds, repeat=3)
+    print(f"{'lookup':>10} {'live, us':>10} {'table, us':>10} {'speedup':>9}")
+    print(f"{'scalar':>10} {t_live / calls * 1e6:>10.2f} {t_table / calls * 1e6:>10.2f} {t_live / t_table:>8.1f}x")
+    print(f"{'vector':>10} {t_live / calls * 1e6:>10.2f} {t_vector / calls * 1e6:>10.2f} {t_live / t_vector:>8.1f}x")
+
+    entry = compute_natal(NATAL)
+    start_jd = transit_jd('2025-01-01', '+03:00')
+    t_table = timeit(compute_transit_period, entry.objects, start_jd, start_jd + 365, 180, repeat=3)
+    ephemeris._table = None
+    t_live = timeit(compute_transit_period, entry.objects, start_jd, start_jd + 365, 180, repeat=3)
+    ephemeris._table = table
+    print(f"\nyearly scan: live {t_live * 1e3:.1f} ms, table {t_table * 1e3:.1f} ms, {t_live / t_table:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Нагрузочный тест приложения в одном процессе: FastAPI-приложение вызывается
+через httpx.ASGITransport, без сети и uvicorn, но с настоящим пулом воркеров,
+кэшами и middleware метрик.
+
+Запросы — смесь /natal, /predict/daily, /predict/monthly, /predict/yearly,
+/predict/progressions и /synastry в пропорциях MIX. Субъекты выбираются из
+пула с перекосом (часть профилей запрашивается часто), поэтому в смеси есть
+и попадания в кэш, и новые расчёты — как у живого сервиса. Целевые даты —
+в пределах месяца от сегодняшнего дня.
+
+Выводится пропускная способность, p50/p95/p99 по эндпоинтам, пиковый RSS
+главного процесса и воркеров пула. Ответы 503 (очередь пула переполнена,
+см. FLATLIB_MAX_PENDING) считаются отдельно от ошибок: если их много,
+concurrency больше, чем сервер готов принять.
+
+    python -m benchmarks.bench_load [--requests 2000] [--concurrency 4] [--subjects 200]
+                                    [--save-baseline | --baseline PATH --threshold 0.2]
+
+Нужен httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+# Календарь и хранилище результатов открываются в lifespan; тест не должен трогать рабочие базы
+# (а сохранённые прошлыми запусками результаты сделали бы замеры несравнимыми)
+BENCH_DIR = tempfile.mkdtemp(prefix="flatlib-bench-")
+os.environ.setdefault("FLATLIB_CALENDAR_DB", os.path.join(BENCH_DIR, "calendar.sqlite3"))
+os.environ.setdefault("FLATLIB_STORE_DB", os.path.join(BENCH_DIR, "results.sqlite3"))
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from benchmarks.common import (
+    add_baseline_arguments, check_baseline, children, latency_stats, peak_rss_mb, random_subject,
+)
+
+# Эндпоинт и его доля в смеси запросов
+MIX = {
+    "/natal": 35,
+    "/predict/daily": 30,
+    "/predict/monthly": 10,
+    "/predict/yearly": 5,
+    "/predict/progressions": 5,
+    "/synastry": 15,
+}
+
+
+class Workload:
+    """Генератор запросов: эндпоинт по MIX, субъекты из пула с перекосом."""
+
+    def __init__(self, subjects: int, seed: int):
+        self.rng = random.Random(seed)
+        self.subjects = [random_subject(self.rng) for _ in range(subjects)]
+        # Вес профиля ~ 1 / ранг: первые профили запрашиваются намного чаще остальных
+        self.weights = [1.0 / (rank + 1) for rank in range(subjects)]
+        self.endpoints = list(MIX)
+        self.shares = list(MIX.values())
+        self.today = date.today()
+
+    def subject(self) -> Dict[str, Any]:
+        return dict(self.rng.choices(self.subjects, self.weights)[0])
+
+    def day(self, fmt: str) -> str:
+        return (self.today + timedelta(days=self.rng.randrange(-15, 16))).strftime(fmt)
+
+    def next(self) -> Tuple[str, Dict[str, Any]]:
+        endpoint = self.rng.choices(self.endpoints, self.shares)[0]
+        body = self.subject()
+        if endpoint == "/predict/daily":
+            body["target_date"] = self.day("%Y/%m/%d")
+        elif endpoint in ("/predict/monthly", "/predict/yearly"):
+            body["start_date"] = self.day("%Y-%m-%d")
+        elif endpoint == "/predict/progressions":
+            born = int(body["date"][:4])
+            body["age"] = self.rng.randrange(max(1, self.today.year - born - 5), self.today.year - born + 1)
+        elif endpoint == "/synastry":
+            body = {"person1": body, "person2": self.subject()}
+        return endpoint, body
+
+
+async def run_load(client, workload: Workload, requests: int, concurrency: int):
+    """
+    Прогоняет requests запросов в concurrency потоков.
+
+    Возвращает (задержки по эндпоинтам, число отказов 503, число ошибок, секунды).
+    """
+    latencies: Dict[str, List[float]] = {endpoint: [] for endpoint in MIX}
+    rejected: Dict[str, int] = {endpoint: 0 for endpoint in MIX}
+    errors: Dict[str, int] = {endpoint: 0 for endpoint in MIX}
+    remaining = iter(range(requests))
+
+    async def user():
+        for _ in remaining:
+            endpoint, body = workload.next()
+            started = time.perf_counter()
+            response = await client.post(endpoint, json=body)
+            latencies[endpoint].append(time.perf_counter() - started)
+            if response.status_code == 503:
+                rejected[endpoint] += 1
+            elif response.status_code != 200:
+                errors[endpoint] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, rejected, errors, time.perf_counter() - started
+
+
+async def benchmark(args) -> Dict[str, Dict[str, float]]:
+    import main
+
+    workload = Workload(args.subjects, args.seed)
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            while main.readiness["status"] == "starting":
+                await asyncio.sleep(0.05)
+            if args.warmup:
+                await run_load(client, workload, args.warmup, args.concurrency)
+            latencies, rejected, errors, elapsed = await run_load(client, workload, args.requests, args.concurrency)
+            workers = [peak_rss_mb(pid) for pid in children(os.getpid())]
+
+    metrics = {}
+    print(f"{'endpoint':<24} {'count':>7} {'503':>7} {'errors':>7} {'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9}")
+    for endpoint in MIX:
+        if not latencies[endpoint]:
+            continue
+        stats = latency_stats(latencies[endpoint])
+        metrics[endpoint] = dict(stats, rejected=rejected[endpoint], errors=errors[endpoint])
+        print(f"{endpoint:<24} {len(latencies[endpoint]):>7} {rejected[endpoint]:>7} {errors[endpoint]:>7} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+
+    everything = [value for values in latencies.values() for value in values]
+    total = metrics["total"] = latency_stats(everything)
+    total["rps"] = round(args.requests / elapsed, 1)
+    total["rejected"] = sum(rejected.values())
+    total["errors"] = sum(errors.values())
+    total["main_peak_rss_mb"] = round(peak_rss_mb(), 1)
+    total["workers_peak_rss_mb"] = round(sum(workers), 1)
+    print(f"\n{args.requests} requests in {elapsed:.2f}s: {total['rps']} req/s, "
+          f"p50 {total['p50_ms']:.2f} ms, p95 {total['p95_ms']:.2f} ms, p99 {total['p99_ms']:.2f} ms, "
+          f"{total['rejected']} rejected (503), {total['errors']} error(s)")
+    print(f"peak RSS: main {total['main_peak_rss_mb']} MB, {len(workers)} worker(s) {total['workers_peak_rss_mb']} MB")
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Concurrent clients (default: 4, the queue of a one-worker pool)")
+    parser.add_argument("--subjects", type=int, default=200, help="Size of the subject pool (default: 200)")
+    parser.add_argument("--warmup", type=int, default=200, help="Requests before the measurement (default: 200)")
+    parser.add_argument("--seed", type=int, default=0)
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    if httpx is None:
+        raise SystemExit("bench_load needs httpx: pip install httpx")
+    # httpx пишет в лог каждый запрос
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    metrics = asyncio.run(benchmark(args))
+    raise SystemExit(check_baseline("load", metrics, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Микробенчмарки этапов расчёта: построение карты, аспекты, сериализация,
+транзитные положения и аспекты, сканирование периода, поиск событий за год,
+синастрия, прогрессии.
+
+Каждый случай вызывается на наборе случайных субъектов (по кругу) не меньше
+--min-time секунд; выводятся p50/p95/p99 одного вызова, число вызовов в
+секунду и пиковый объём памяти, выделяемой за вызов (tracemalloc).
+
+    python -m benchmarks.bench_micro [--min-time 1.0] [--save-baseline | --baseline PATH --threshold 0.2]
+
+С --save-baseline результаты сохраняются в benchmarks/baselines/micro.json;
+без него сравниваются с сохранёнными, и при регрессии код выхода равен 1.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from flatlib import const
+from flatlib.datetime import Datetime
+from flatlib.geopos import GeoPos
+
+from charts import (
+    ChartRecord, build_chart, calculate_aspects, compute_natal, compute_synastry,
+    compute_transit_positions, get_transits_for_date, transit_jd, utcoffset_minutes,
+)
+from progressions import compute_progressions
+from events import find_events
+from scan import compute_transit_period
+from serialization import dumps
+
+from benchmarks.common import add_baseline_arguments, check_baseline, latency_stats, random_subject
+
+SUBJECTS = 64
+
+
+def prepare(rng: random.Random) -> List[dict]:
+    """Субъекты с заранее рассчитанными картами и транзитными положениями."""
+    subjects = []
+    for _ in range(SUBJECTS):
+        natal = random_subject(rng)
+        target = f"20{rng.randrange(20, 35)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}"
+        record = compute_natal(natal)
+        jd = transit_jd(target, natal['tz'])
+        subjects.append({
+            "natal": natal,
+            # Только долготы планет: без домов, аспектов и особых точек
+            "planets_only": dict(natal, houses=False, aspects=False, special=False),
+            "target": target,
+            "date": Datetime(natal['date'], natal['time'], natal['tz']),
+            "pos": GeoPos(natal['lat'], natal['lon']),
+            "record": record,
+            "aspects": calculate_aspects(record),
+            "jd": jd,
+            "offset": utcoffset_minutes(natal['tz']),
+            "transit_objects": compute_transit_positions(jd),
+        })
+    return subjects
+
+
+def cases(subjects: List[dict]) -> Dict[str, Callable[[int], object]]:
+    """Случаи: функция от номера вызова (субъект берётся по кругу)."""
+    count = len(subjects)
+
+    def subject(n: int) -> dict:
+        return subjects[n % count]
+
+    def record(n: int) -> ChartRecord:
+        return subject(n)["record"]
+
+    return {
+        "build_chart": lambda n: build_chart(subject(n)["date"], subject(n)["pos"], const.HOUSES_PLACIDUS),
+        "calculate_aspects": lambda n: calculate_aspects(record(n)),
+        "serialize_natal": lambda n: dumps(record(n).to_dict(subject(n)["aspects"])),
+        "compute_natal": lambda n: compute_natal(subject(n)["natal"]),
+        "compute_natal_planets": lambda n: compute_natal(subject(n)["planets_only"]),
+        "transit_positions": lambda n: compute_transit_positions(subject(n)["jd"] + n * 0.001),
+        "get_transits_for_date": lambda n: get_transits_for_date(
+            subject(n)["natal"], subject(n)["target"], record(n).objects, subject(n)["transit_objects"]),
+        "scan_month": lambda n: compute_transit_period(
+            record(n).objects, subject(n)["jd"], subject(n)["jd"] + 31, subject(n)["offset"]),
+        "events_year": lambda n: find_events(
+            record(n).objects, subject(n)["jd"], subject(n)["jd"] + 365, subject(n)["offset"]),
+        "synastry": lambda n: compute_synastry(record(n).objects, record(n + 1).objects),
+        "progressions": lambda n: compute_progressions(
+            subject(n)["natal"], record(n).objects, [35], subject(n)["offset"]),
+    }
+
+
+def run_case(fn: Callable[[int], object], min_time: float) -> Dict[str, float]:
+    for n in range(5):
+        fn(n)
+
+    durations = []
+    started = time.perf_counter()
+    n = 0
+    while time.perf_counter() - started < min_time or n < 20:
+        call_started = time.perf_counter()
+        fn(n)
+        durations.append(time.perf_counter() - call_started)
+        n += 1
+    elapsed = time.perf_counter() - started
+
+    # Память — отдельно: tracemalloc заметно замедляет вызовы
+    peaks = []
+    tracemalloc.start()
+    for m in range(10):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(m)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    stats = latency_stats(durations, unit="us")
+    stats["ops_per_s"] = round(n / elapsed, 1)
+    stats["alloc_kb"] = round(max(peaks) / 1024, 1)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds per case (default: 1.0)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="Run only these cases")
+    add_baseline_arguments(parser)
+    args = parser.parse_args()
+
+    subjects = prepare(random.Random(args.seed))
+    metrics = {}
+    print(f"{'case':<24} {'p50, us':>10} {'p95, us':>10} {'p99, us':>10} {'ops/s':>10} {'alloc, KB':>10}")
+    for name, fn in cases(subjects).items():
+        if args.only and name not in args.only:
+            continue
+        stats = metrics[name] = run_case(fn, args.min_time)
+        print(f"{name:<24} {stats['p50_us']:>10.1f} {stats['p95_us']:>10.1f} {stats['p99_us']:>10.1f} "
+              f"{stats['ops_per_s']:>10.1f} {stats['alloc_kb']:>10.1f}")
+
+    raise SystemExit(check_baseline("micro", metrics, args))
+
+
+if __name__ == "__main__":
+    main()
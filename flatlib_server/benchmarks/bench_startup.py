@@ -0,0 +1,113 @@
+"""
+Холодный старт сервера: время импорта, время до первого ответа и память.
+
+Каждый замер делается в новом процессе. Сначала измеряется импорт main
+(время и пиковый RSS), затем запускается uvicorn и опрашиваются /health,
+/ready и первый /natal; в конце выводится RSS главного процесса и воркеров
+пула в простое.
+
+    python -m benchmarks.bench_startup [--runs 3]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.common import children, rss_mb
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NATAL = {'date': '1990/05/03', 'time': '13:20:00', 'tz': '+03:00', 'lat': 56.2575, 'lon': 43.9824}
+
+IMPORT_PROBE = """
+import resource, time
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+"""
+
+
+def measure_import():
+    """(секунды, пиковый RSS в МБ) для import main в новом процессе."""
+    output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=SERVER_DIR, check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[0]), float(output[1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(url: str, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def wait_for(url: str, started: float, timeout: float = 60.0):
+    """Секунды от запуска до ответа 200 или None, если эндпоинта нет."""
+    while time.perf_counter() - started < timeout:
+        status = request(url)
+        if status == 200:
+            return time.perf_counter() - started
+        if status == 404:
+            return None
+        time.sleep(0.01)
+    raise TimeoutError(url)
+
+
+def measure_server():
+    """Время до /health, /ready и первого /natal, RSS главного процесса и воркеров."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+                              cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        health = wait_for(f"{base}/health", started)
+        ready = wait_for(f"{base}/ready", started)
+        natal_start = time.perf_counter()
+        if request(f"{base}/natal", NATAL) != 200:
+            raise RuntimeError("/natal failed")
+        natal = time.perf_counter() - natal_start
+        first = time.perf_counter() - started
+        time.sleep(1.0)
+        workers = [rss_mb(pid) for pid in children(server.pid)]
+        return health, ready, natal, first, rss_mb(server.pid), sum(workers), len(workers)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    print(f"import main: {statistics.median(t for t, _ in imports) * 1e3:.0f} ms, "
+          f"peak RSS {statistics.median(m for _, m in imports):.1f} MB")
+
+    runs = [measure_server() for _ in range(args.runs)]
+    median = lambda n: statistics.median(run[n] for run in runs if run[n] is not None) if runs[0][n] is not None else None
+    fmt = lambda value: f"{value * 1e3:.0f} ms" if value is not None else "n/a"
+    print(f"/health after {fmt(median(0))}, /ready after {fmt(median(1))}")
+    print(f"first /natal: {fmt(median(2))} (response at {fmt(median(3))} after start)")
+    print(f"idle RSS: main {median(4):.1f} MB, {runs[0][6]} worker(s) {median(5):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
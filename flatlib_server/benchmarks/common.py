@@ -0,0 +1,180 @@
+"""
+Общие функции бенчмарков: случайные субъекты, статистика, память и
+сохранение/сравнение базовых результатов.
+
+Базовый результат — JSON с метриками набора (bench_micro, bench_load),
+снятыми на конкретной машине. При сравнении метрика считается регрессией,
+если она хуже базовой больше чем на порог (по умолчанию 20 %): для времени
+и памяти — больше, для пропускной способности — меньше. Базовые результаты
+разных машин несравнимы, поэтому их стоит снимать на той же машине, где
+запускается проверка (например, на CI-раннере до и после обновления flatlib).
+"""
+import json
+import os
+import platform
+import random
+import resource
+import sys
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+DEFAULT_THRESHOLD = 0.2
+
+# Метрики, у которых больше — лучше; у остальных (время, память) лучше меньше
+HIGHER_IS_BETTER = ("ops_per_s", "rps")
+
+TIMEZONES = ["+03:00", "+00:00", "-05:00", "+05:30", "+09:00", "-08:00", "+01:00"]
+
+
+def random_subject(rng: random.Random) -> Dict[str, Any]:
+    """Данные рождения в формате NatalChartRequest."""
+    born = date(1940, 1, 1) + timedelta(days=rng.randrange(70 * 365))
+    return {
+        "date": born.strftime("%Y/%m/%d"),
+        "time": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:00",
+        "tz": rng.choice(TIMEZONES),
+        "lat": round(rng.uniform(-60, 65), 4),
+        "lon": round(rng.uniform(-170, 170), 4),
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0..100) отсортированного списка, с линейной интерполяцией."""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def latency_stats(seconds: List[float], unit: str = "ms") -> Dict[str, float]:
+    """p50/p95/p99 и среднее; unit — "ms" или "us"."""
+    scale = 1e3 if unit == "ms" else 1e6
+    values = sorted(seconds)
+    return {
+        f"p50_{unit}": round(percentile(values, 50) * scale, 3),
+        f"p95_{unit}": round(percentile(values, 95) * scale, 3),
+        f"p99_{unit}": round(percentile(values, 99) * scale, 3),
+        f"mean_{unit}": round(sum(values) / len(values) * scale, 3) if values else 0.0,
+    }
+
+
+# --- Память ---
+def rss_mb(pid: int) -> float:
+    """Текущий RSS процесса в мегабайтах (Linux)."""
+    return _proc_status_mb(pid, "VmRSS:")
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> float:
+    """Пиковый RSS процесса; для текущего процесса — и вне Linux."""
+    if pid is None or pid == os.getpid():
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss в килобайтах на Linux и в байтах на macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return _proc_status_mb(pid, "VmHWM:")
+
+
+def _proc_status_mb(pid: int, field: str) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def children(pid: int) -> List[int]:
+    """Дочерние процессы (воркеры пула), Linux."""
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+# --- Базовые результаты ---
+def environment() -> Dict[str, str]:
+    """Версии Python и библиотек расчёта — чтобы было видно, что изменилось между замерами."""
+    from importlib import metadata
+
+    env = {"python": platform.python_version(), "machine": platform.machine(), "cpus": str(os.cpu_count())}
+    for package in ("flatlib", "pyswisseph", "numpy", "fastapi", "pydantic", "orjson"):
+        try:
+            env[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            env[package] = "not installed"
+    return env
+
+
+def baseline_path(suite: str, path: Optional[str] = None) -> str:
+    return path or os.path.join(BASELINE_DIR, f"{suite}.json")
+
+
+def save_baseline(suite: str, metrics: Dict[str, Dict[str, float]], path: Optional[str] = None) -> str:
+    path = baseline_path(suite, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"suite": suite, "environment": environment(), "metrics": metrics}, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare(metrics: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """Регрессии относительно базового результата: строки вида "case.metric: было -> стало (+25%)"."""
+    regressions = []
+    for case, values in metrics.items():
+        for name, value in values.items():
+            base = baseline.get(case, {}).get(name)
+            if not base or not isinstance(value, (int, float)):
+                continue
+            change = (value - base) / base
+            worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+            if worse > threshold:
+                regressions.append(f"{case}.{name}: {base:g} -> {value:g} ({change:+.0%})")
+    return regressions
+
+
+def check_baseline(suite: str, metrics: Dict[str, Dict[str, float]], args) -> int:
+    """
+    Сохраняет (--save-baseline) или сравнивает с базовым результатом.
+
+    Возвращает код выхода: 1, если найдены регрессии, иначе 0.
+    """
+    if args.save_baseline:
+        print(f"\nbaseline saved to {save_baseline(suite, metrics, args.baseline)}")
+        return 0
+
+    path = baseline_path(suite, args.baseline)
+    if not os.path.exists(path):
+        print(f"\nno baseline at {path} (save one with --save-baseline)")
+        return 0
+    with open(path) as f:
+        saved = json.load(f)
+
+    changed = {k: (v, environment().get(k)) for k, v in saved.get("environment", {}).items()
+               if environment().get(k) != v}
+    for name, (old, new) in sorted(changed.items()):
+        print(f"note: {name} {old} -> {new} since the baseline")
+
+    regressions = compare(metrics, saved["metrics"], args.threshold)
+    if regressions:
+        print(f"\nREGRESSIONS (threshold {args.threshold:.0%}):")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nno regressions against {path} (threshold {args.threshold:.0%})")
+    return 0
+
+
+def add_baseline_arguments(parser):
+    parser.add_argument("--baseline", help="Path of the baseline JSON (default: benchmarks/baselines/<suite>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown that counts as a regression (default: 0.2)")
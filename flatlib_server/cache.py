@@ -0,0 +1,112 @@
+"""
+Кэш рассчитанных карт в памяти процесса.
+
+Ключ — нормализованные входные данные (см. charts.natal_key), значение —
+готовый результат расчёта. Размер кэша ограничен числом записей и примерным
+объёмом памяти; устаревшие записи удаляются по TTL.
+
+Настройки задаются переменными окружения:
+  FLATLIB_CACHE_SIZE  — максимум записей (по умолчанию 1024, 0 — кэш выключен)
+  FLATLIB_CACHE_MB    — максимум памяти в мегабайтах (по умолчанию 64)
+  FLATLIB_CACHE_TTL   — время жизни записи в секундах (по умолчанию 86400, 0 — без TTL)
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+CACHE_SIZE = int(os.getenv("FLATLIB_CACHE_SIZE", 1024))
+CACHE_MB = float(os.getenv("FLATLIB_CACHE_MB", 64))
+CACHE_TTL = float(os.getenv("FLATLIB_CACHE_TTL", 86400))
+
+
+def approx_size(value) -> int:
+    """Примерный размер объекта в байтах (с учётом вложенных контейнеров)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(approx_size(v) for v in value)
+    elif hasattr(value, "__slots__"):
+        size += sum(approx_size(getattr(value, name)) for name in value.__slots__)
+    return size
+
+
+class ChartCache:
+    """
+    LRU-кэш с TTL и ограничением по памяти.
+
+    Хранит значения как есть, без копирования: вызывающий код не должен
+    изменять полученные из кэша объекты.
+    """
+
+    def __init__(self, name: str, max_entries: int = CACHE_SIZE,
+                 max_bytes: int = int(CACHE_MB * 1024 * 1024), ttl: float = CACHE_TTL):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        # key -> (value, size, expires_at)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = item
+            if expires_at and expires_at < time.monotonic():
+                self._remove(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        size = approx_size(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,474 @@
+"""
+Расчёт карт: константы объектов, сериализация и вычислительные задачи.
+
+Функции этого модуля синхронные и не зависят от FastAPI, поэтому их можно
+выполнять в пуле процессов (см. executor.py).
+"""
+import logging
+import re
+from array import array
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+
+from flatlib.datetime import Datetime
+from flatlib.geopos import GeoPos
+from flatlib.chart import Chart
+from flatlib.lists import GenericList, HouseList
+from flatlib.ephem import eph, ephem
+from flatlib.ephem.swe import SWE_HOUSESYS
+from flatlib import const
+
+from aspects import AspectTable, aspect_motion, find_aspects, upper_triangle_mask, different_ids_mask
+from ephemeris import body_position
+from metrics import stage
+from serialization import dumps, loads
+
+# --- Константы Flatlib ---
+PLANET_IDS = [
+    const.SUN, const.MOON, const.MERCURY, const.VENUS, const.MARS,
+    const.JUPITER, const.SATURN
+]
+SPECIAL_OBJECTS = [
+    const.NORTH_NODE, const.SOUTH_NODE, 
+    const.SYZYGY, 
+    const.PARS_FORTUNA
+]
+ANGLE_IDS = [const.ASC, const.MC]
+# Объекты натальной карты в порядке расчёта (= const.LIST_OBJECTS_TRADITIONAL)
+NATAL_OBJECTS = PLANET_IDS + SPECIAL_OBJECTS
+# Системы домов, которые понимает flatlib (Placidus, Koch, Whole Sign, ...)
+HOUSE_SYSTEMS = tuple(SWE_HOUSESYS)
+ASPECT_TYPES = [
+    const.NO_ASPECT, const.CONJUNCTION, const.OPPOSITION,
+    const.SQUARE, const.TRINE, const.SEXTILE
+]
+ASPECT_NAMES = {
+    const.CONJUNCTION: "Conjunction",
+    const.OPPOSITION: "Opposition",
+    const.SQUARE: "Square",
+    const.TRINE: "Trine",
+    const.SEXTILE: "Sextile",
+    # Минорные аспекты (включаются через FLATLIB_MINOR_ASPECTS, см. aspects.py)
+    const.SEMISEXTILE: "Semisextile",
+    const.SEMIQUINTILE: "Semiquintile",
+    const.SEMISQUARE: "Semisquare",
+    const.QUINTILE: "Quintile",
+    const.SESQUIQUINTILE: "Sesquiquintile",
+    const.SESQUISQUARE: "Sesquisquare",
+    const.BIQUINTILE: "Biquintile",
+    const.QUINCUNX: "Quincunx",
+}
+TRANSIT_ORBS = {
+    const.CONJUNCTION: 8,
+    const.OPPOSITION: 8,
+    const.SQUARE: 7,
+    const.TRINE: 7,
+    const.SEXTILE: 5,
+}
+NATAL_ORBS = {
+    const.CONJUNCTION: 8.0,
+    const.OPPOSITION: 8.0,
+    const.SQUARE: 6.0,
+    const.TRINE: 6.0,
+    const.SEXTILE: 4.0,
+}
+
+# Таблицы аспектов для векторизованного поиска (порядок = порядок проверки)
+NATAL_ASPECTS = AspectTable(NATAL_ORBS)
+TRANSIT_ASPECTS = AspectTable(TRANSIT_ORBS)
+SYNASTRY_ASPECTS = AspectTable(TRANSIT_ORBS)
+# Для синастрии используются только основные объекты, чтобы избежать избыточности
+SYNASTRY_IDS = frozenset(PLANET_IDS + ANGLE_IDS)
+
+# --- Параметры расчёта карты ---
+class ChartOptions(NamedTuple):
+    """
+    Что считать в натальной карте. Входит в ключ кэша, поэтому карты с разными
+    параметрами кэшируются отдельно.
+
+    hsys — система домов; objects — объекты карты (в порядке NATAL_OBJECTS);
+    houses — считать ли дома и углы (они получаются одним вызовом swisseph);
+    aspects — считать ли аспекты.
+    """
+    hsys: str = const.HOUSES_PLACIDUS
+    objects: Tuple[str, ...] = tuple(NATAL_OBJECTS)
+    houses: bool = True
+    aspects: bool = True
+
+DEFAULT_OPTIONS = ChartOptions()
+
+def chart_options(natal_data: dict) -> ChartOptions:
+    """
+    Параметры расчёта из запроса /natal (house_system, objects, houses, aspects, special).
+
+    Запросы без этих полей (транзиты, синастрия, прогрессии) получают полную
+    карту по умолчанию. special=false убирает узлы, Syzygy и Pars Fortuna —
+    последние две самые дорогие в расчёте.
+    """
+    objects = natal_data.get('objects')
+    if objects is None:
+        objects = NATAL_OBJECTS
+    if not natal_data.get('special', True):
+        objects = [obj_id for obj_id in objects if obj_id not in SPECIAL_OBJECTS]
+    return ChartOptions(
+        hsys=natal_data.get('house_system') or const.HOUSES_PLACIDUS,
+        objects=tuple(obj_id for obj_id in NATAL_OBJECTS if obj_id in objects),
+        houses=natal_data.get('houses', True),
+        aspects=natal_data.get('aspects', True),
+    )
+
+# --- Ключи кэша ---
+# Форматы даты и часового пояса, которые flatlib разбирает так же, как natal_key и
+# utcoffset_minutes. Остальные (например, '+0530' — flatlib читает его как 530 часов,
+# или '2000.01.01') отклоняются при проверке запроса (см. main.py), иначе ключ кэша
+# и расчёт разошлись бы.
+DATE_PATTERN = r"^\d{1,4}[-/]\d{1,2}[-/]\d{1,2}$"
+TZ_PATTERN = r"^[+-]?(?:[01]?\d|2[0-3])(?::[0-5]\d)?$"
+_DATE_RE = re.compile(r"^(\d{1,4})[-/](\d{1,2})[-/](\d{1,2})$")
+_TZ_RE = re.compile(r"^([+-]?)((?:[01]?\d|2[0-3]))(?::([0-5]\d))?$")
+
+def utcoffset_minutes(tz: str) -> Optional[int]:
+    """Смещение часового пояса ('+03:00', '-5') в минутах или None, если формат не распознан."""
+    match = _TZ_RE.match(tz)
+    if not match:
+        return None
+    sign, hours, minutes = match.groups()
+    return (int(hours) * 60 + int(minutes or 0)) * (-1 if sign == '-' else 1)
+
+def natal_key(natal_data: dict) -> tuple:
+    """
+    Нормализованный ключ натальной карты: (дата, время, смещение tz в минутах, lat, lon, параметры расчёта).
+
+    '1990-5-3', '1990/05/03', '+3' и '+03:00' дают один и тот же ключ.
+    Нормализуются только формы, которые flatlib понимает одинаково (DATE_PATTERN,
+    TZ_PATTERN); прочие строки попадают в ключ как есть, поэтому разные карты
+    никогда не получают общий ключ.
+    """
+    date = natal_data['date']
+    match = _DATE_RE.match(date)
+    if match:
+        date = "%04d/%02d/%02d" % tuple(int(g) for g in match.groups())
+
+    time_str = natal_data['time']
+    parts = time_str.strip().split(':')
+    if 1 <= len(parts) <= 3 and all(p.isdigit() for p in parts):
+        time_str = "%02d:%02d:%02d" % tuple(int(p) for p in parts + ['0'] * (3 - len(parts)))
+
+    tz = natal_data['tz']
+    offset = utcoffset_minutes(tz)
+    if offset is not None:
+        tz = offset
+
+    return (date, time_str, tz, round(float(natal_data['lat']), 6), round(float(natal_data['lon']), 6),
+            chart_options(natal_data))
+
+# --- Вспомогательные функции ---
+def object_positions(chart) -> List[Tuple[str, float, float]]:
+    """Точные (неокруглённые) долготы и скорости объектов карты в порядке chart.objects."""
+    return [(obj.id, obj.lon, obj.lonspeed) for obj in chart.objects]
+
+# Порог скорости, ниже которого flatlib считает объект стационарным (Object.movement)
+STATIONARY_SPEED = 0.0003
+
+def point_data(obj_id: str, lon: float) -> Dict[str, Any]:
+    """Угол или куспид дома: знак и положение в знаке считаются по долготе, как в flatlib."""
+    return {
+        "id": obj_id,
+        "sign": const.LIST_SIGNS[int(lon / 30)],
+        "sign_pos": round(lon % 30, 2),
+        "lon": round(lon, 4)
+    }
+
+def object_data(obj_id: str, lon: float, lat: float, speed: float) -> Dict[str, Any]:
+    """Планета или особая точка: положение, скорость и ретроградность."""
+    data = point_data(obj_id, lon)
+    data["lat"] = round(lat, 4)
+    data["speed"] = round(speed, 4)
+    data["retrograde"] = speed <= -STATIONARY_SPEED
+    return data
+
+# Точки без собственного непрерывного движения: для сходимости аспектов их скорость равна 0
+STATIC_OBJECTS = [const.SYZYGY, const.PARS_FORTUNA] + ANGLE_IDS
+
+def motion_speed(obj_id: str, lonspeed: float) -> float:
+    """Скорость объекта для расчёта сходимости аспектов."""
+    return 0.0 if obj_id in STATIC_OBJECTS else lonspeed
+
+def round_days(days: Optional[float]) -> Optional[float]:
+    return round(days, 2) if days is not None else None
+
+def calculate_aspects(record: "ChartRecord") -> List[Dict[str, Any]]:
+    """Рассчитывает аспекты между всеми объектами карты."""
+    positions = dict(zip(record.object_ids, zip(record.lons, record.speeds)))
+    positions.update((angle_id, (lon, 0.0)) for angle_id, lon in zip(record.angle_ids, record.angle_lons))
+    ids = [o_id for o_id in PLANET_IDS + SPECIAL_OBJECTS + ANGLE_IDS if o_id in positions]
+
+    lons = [positions[o_id][0] for o_id in ids]
+    speeds = [motion_speed(o_id, positions[o_id][1]) for o_id in ids]
+    with stage("aspects"):
+        found = find_aspects(lons, lons, NATAL_ASPECTS, mask=upper_triangle_mask(len(lons)))
+        applying, days = aspect_motion(lons, speeds, lons, speeds, found)
+
+    return [
+        {
+            "id1": ids[i], "id2": ids[j],
+            "type": ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}"),
+            "difference": round(distance, 4), "orb": round(orb, 4),
+            "is_applying": is_applying, "days_to_exact": round_days(days_to_exact),
+        }
+        for i, j, aspect_type, distance, orb, is_applying, days_to_exact in zip(*found, applying, days)
+    ]
+
+# Транзитные объекты, положение которых зависит только от момента времени.
+# Pars Fortuna сюда не входит: она считается от асцендента места рождения.
+TRANSIT_OBJECTS = PLANET_IDS + [const.NORTH_NODE, const.SOUTH_NODE, const.SYZYGY]
+
+def transit_jd(target_date: str, tz: str) -> float:
+    """Юлианская дата полудня target_date в часовом поясе tz — момент транзитов."""
+    return Datetime(target_date.replace("-", "/"), '12:00:00', tz).jd
+
+def compute_transit_positions(jd: float) -> List[Tuple[str, float, float]]:
+    """
+    Долготы и скорости TRANSIT_OBJECTS на момент jd.
+
+    Дома не рассчитываются, результат не зависит от места и натальной карты,
+    поэтому его можно один раз посчитать и раздавать всем пользователям.
+    Планеты и узлы берутся из таблицы эфемерид (см. ephemeris.py), Syzygy — из swisseph.
+    """
+    positions = []
+    with stage("ephemeris"):
+        for obj_id in TRANSIT_OBJECTS:
+            if obj_id == const.SYZYGY:
+                obj = eph.getObject(obj_id, jd, 0.0, 0.0)
+                positions.append((obj_id, obj['lon'], obj['lonspeed']))
+            else:
+                positions.append((obj_id,) + body_position(obj_id, jd))
+    return positions
+
+def get_transits_for_date(natal_data: dict, target_date: str,
+                          natal_objects: Optional[List[Tuple[str, float, float]]] = None,
+                          transit_objects: Optional[List[Tuple[str, float, float]]] = None) -> List[Dict[str, Any]]:
+    """
+    Рассчитывает транзитные аспекты на конкретную дату, используя старый метод.
+
+    natal_objects — уже рассчитанные положения натальных объектов (ChartRecord.objects);
+    если не переданы, натальная карта строится заново.
+    transit_objects — положения на момент transit_jd() из compute_transit_positions();
+    если не переданы, рассчитываются здесь.
+    """
+    try:
+        # 1. Берём натальные объекты из кэша или создаём натальную карту
+        birth_pos = GeoPos(natal_data['lat'], natal_data['lon'])
+        if natal_objects is None:
+            birth_date = Datetime(natal_data['date'].replace("-", "/"), natal_data['time'], natal_data['tz'])
+            # Дома для транзитов не нужны
+            natal_objects = object_positions(build_chart(birth_date, birth_pos, const.HOUSES_PLACIDUS, houses=False))
+
+        # 2. Транзитные положения на полдень целевой даты (общие для всех пользователей)
+        jd = transit_jd(target_date, natal_data['tz'])
+        if transit_objects is None:
+            transit_objects = compute_transit_positions(jd)
+
+        # Pars Fortuna зависит от асцендента, поэтому считается для места рождения
+        pars_fortuna = eph.getObject(const.PARS_FORTUNA, jd, birth_pos.lat, birth_pos.lon)
+        transit_objects = transit_objects + [(const.PARS_FORTUNA, pars_fortuna['lon'], pars_fortuna['lonspeed'])]
+
+        # 3. Рассчитываем аспекты между транзитными и натальными объектами.
+        # Один и тот же объект в разных картах (транзитное Солнце к натальному) не учитывается.
+        transit_ids = [obj[0] for obj in transit_objects]
+        natal_ids = [obj[0] for obj in natal_objects]
+        with stage("aspects"):
+            found = find_aspects(
+                [obj[1] for obj in transit_objects], [obj[1] for obj in natal_objects],
+                TRANSIT_ASPECTS, mask=different_ids_mask(transit_ids, natal_ids),
+            )
+
+            # Натальные точки неподвижны: сходимость определяет только скорость транзитного объекта
+            transit_lons = [obj[1] for obj in transit_objects]
+            transit_speeds = [motion_speed(obj[0], obj[2]) for obj in transit_objects]
+            natal_lons = [obj[1] for obj in natal_objects]
+            applying, days = aspect_motion(transit_lons, transit_speeds, natal_lons, [0.0] * len(natal_lons), found)
+
+        transits = []
+        for i, j, aspect_type, _, orb, is_applying, days_to_exact in zip(*found, applying, days):
+            transits.append({
+                'transit_planet': transit_ids[i],
+                'aspect': ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}"),
+                'natal_planet': natal_ids[j],
+                'orb': round(orb, 2),
+                'is_applying': is_applying,
+                'days_to_exact': round_days(days_to_exact),
+            })
+        return transits
+    except Exception as e:
+        # Добавляем логгирование для более детальной информации об ошибке
+        logging.error(f"Error in get_transits_for_date: {e}", exc_info=True)
+        raise e
+
+# --- Вычислительные задачи (выполняются в пуле, см. executor.py) ---
+class ChartRecord:
+    """
+    Рассчитанная натальная карта в компактном виде — для кэша, передачи из
+    воркера и расчётов транзитов, прогрессий и синастрии.
+
+    Положения хранятся в плоских массивах array('d'): объекты в порядке
+    chart.objects, углы, куспиды домов. Знак, положение в знаке и
+    ретроградность из них выводятся так же, как в flatlib. json — готовое
+    тело ответа /natal, сериализованное в воркере один раз.
+    """
+
+    __slots__ = ("object_ids", "lons", "lats", "speeds", "angle_ids", "angle_lons",
+                 "house_ids", "house_lons", "json")
+
+    def __init__(self, object_ids: Tuple[str, ...], lons: array, lats: array, speeds: array,
+                 angle_ids: Tuple[str, ...], angle_lons: array,
+                 house_ids: Tuple[str, ...], house_lons: array, json: bytes = b""):
+        self.object_ids = object_ids
+        self.lons = lons
+        self.lats = lats
+        self.speeds = speeds
+        self.angle_ids = angle_ids
+        self.angle_lons = angle_lons
+        self.house_ids = house_ids
+        self.house_lons = house_lons
+        self.json = json
+
+    @classmethod
+    def from_chart(cls, chart: Chart) -> "ChartRecord":
+        angles = []
+        # Без домов (houses=False) нет и углов; у GenericList нет __len__, поэтому проверяем content
+        for angle_id in ANGLE_IDS if chart.angles.content else ():
+            try:
+                angles.append(chart.get(angle_id))
+            except Exception as e:
+                logging.warning(f"Could not get angle {angle_id}: {e}")
+        return cls(
+            tuple(obj.id for obj in chart.objects),
+            array('d', [obj.lon for obj in chart.objects]),
+            array('d', [obj.lat for obj in chart.objects]),
+            array('d', [obj.lonspeed for obj in chart.objects]),
+            tuple(obj.id for obj in angles), array('d', [obj.lon for obj in angles]),
+            tuple(house.id for house in chart.houses), array('d', [house.lon for house in chart.houses]),
+        )
+
+    @property
+    def objects(self) -> List[Tuple[str, float, float]]:
+        """Точные долготы и скорости объектов (id, lon, lonspeed) в порядке chart.objects."""
+        return list(zip(self.object_ids, self.lons, self.speeds))
+
+    @property
+    def result(self) -> Dict[str, Any]:
+        """Ответ /natal в виде словаря (для пакетных ответов)."""
+        return loads(self.json)
+
+    def to_dict(self, aspects: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ответ /natal: планеты, особые точки, углы, дома и аспекты."""
+        objects = list(zip(self.object_ids, self.lons, self.lats, self.speeds))
+        return {
+            'planets': {obj[0]: object_data(*obj) for obj in objects if obj[0] in PLANET_IDS},
+            'special': {obj[0]: object_data(*obj) for obj in objects if obj[0] in SPECIAL_OBJECTS},
+            'angles': {angle_id: point_data(angle_id, lon) for angle_id, lon in zip(self.angle_ids, self.angle_lons)},
+            'houses': {f"House {house_id}": point_data(house_id, lon)
+                       for house_id, lon in zip(self.house_ids, self.house_lons)},
+            'aspects': aspects,
+        }
+
+def build_chart(date: Datetime, pos: GeoPos, hsys: str,
+                objects: List[str] = const.LIST_OBJECTS_TRADITIONAL, houses: bool = True) -> Chart:
+    """
+    То же, что Chart(date, pos, hsys=hsys, IDs=objects), но объекты и дома
+    строятся отдельными этапами, чтобы их время было видно в метриках.
+    С houses=False дома и углы не рассчитываются вовсе (пустые списки).
+    """
+    chart = Chart.__new__(Chart)
+    chart.date = date
+    chart.pos = pos
+    chart.hsys = hsys
+    with stage("chart"):
+        chart.objects = ephem.getObjectList(objects, date, pos)
+    if houses:
+        with stage("houses"):
+            chart.houses, chart.angles = ephem.getHouses(date, pos, hsys)
+    else:
+        chart.houses, chart.angles = HouseList([]), GenericList([])
+    return chart
+
+def compute_natal(natal_data: dict) -> ChartRecord:
+    """
+    Рассчитывает натальную карту: компактную запись с долготами объектов
+    для транзитов и синастрии и готовым телом ответа /natal.
+
+    Что именно считать, задают поля запроса (см. chart_options): ненужные
+    объекты, дома и аспекты не рассчитываются, а не отбрасываются после расчёта.
+    """
+    options = chart_options(natal_data)
+    with stage("parse"):
+        date_str = natal_data['date'].replace("-", "/")
+        dt = Datetime(date_str, natal_data['time'], natal_data['tz'])
+        pos = GeoPos(natal_data['lat'], natal_data['lon'])
+
+    logging.info(f"Calculating chart for date='{dt}', pos=({natal_data['lat']}, {natal_data['lon']})")
+
+    chart = build_chart(dt, pos, options.hsys, options.objects, options.houses)
+
+    record = ChartRecord.from_chart(chart)
+    aspects = calculate_aspects(record) if options.aspects else []
+    with stage("serialize"):
+        record.json = dumps(record.to_dict(aspects))
+    return record
+
+def synastry_aspect(obj1: str, obj2: str, aspect_type: int, orb: float,
+                    is_applying: bool, days_to_exact: Optional[float]) -> Dict[str, Any]:
+    """Синастрический аспект в формате ответа /synastry."""
+    return {
+        'person1_object': obj1,
+        'aspect': ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}"),
+        'person2_object': obj2,
+        'orb': round(orb, 2),
+        'is_applying': is_applying,
+        'days_to_exact': round_days(days_to_exact),
+    }
+
+def compute_synastry(person1_objects: List[Tuple[str, float, float]],
+                     person2_objects: List[Tuple[str, float, float]]) -> List[Dict[str, Any]]:
+    """
+    Рассчитывает синастрические аспекты между двумя натальными картами
+    по долготам их объектов (ChartRecord.objects).
+    """
+    person1_objects = [obj for obj in person1_objects if obj[0] in SYNASTRY_IDS]
+    person2_objects = [obj for obj in person2_objects if obj[0] in SYNASTRY_IDS]
+
+    # Рассчитываем аспекты между всеми планетами двух карт.
+    # Для пары возвращаются все подходящие аспекты, а не только первый.
+    with stage("aspects"):
+        found = find_aspects(
+            [obj[1] for obj in person1_objects], [obj[1] for obj in person2_objects],
+            SYNASTRY_ASPECTS, first_only=False,
+        )
+
+        # Сходимость — по натальным скоростям объектов обеих карт
+        applying, days = aspect_motion(
+            [obj[1] for obj in person1_objects], [motion_speed(obj[0], obj[2]) for obj in person1_objects],
+            [obj[1] for obj in person2_objects], [motion_speed(obj[0], obj[2]) for obj in person2_objects],
+            found,
+        )
+
+    return [
+        synastry_aspect(person1_objects[i][0], person2_objects[j][0], aspect_type, orb, is_applying, days_to_exact)
+        for i, j, aspect_type, _, orb, is_applying, days_to_exact in zip(*found, applying, days)
+    ]
+
+def run_batch(fn, args_list: List[tuple]) -> List[Tuple[Any, Optional[str]]]:
+    """
+    Выполняет fn(*args) для каждого набора аргументов.
+
+    Возвращает пары (результат, None) или (None, текст ошибки), чтобы ошибка
+    одного элемента пакета не прерывала расчёт остальных.
+    """
+    results = []
+    for args in args_list:
+        try:
+            results.append((fn(*args), None))
+        except Exception as e:
+            logging.error(f"Error in batch item {fn.__name__}: {e}")
+            results.append((None, str(e)))
+    return results
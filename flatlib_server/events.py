@@ -0,0 +1,151 @@
+"""
+Поиск точных моментов астрологических событий за период.
+
+Типы событий (для планет PLANET_IDS):
+  ingress — вход в знак (в том числе обратный вход при ретроградности);
+  station — станция: смена прямого движения на ретроградное и обратно;
+  return  — возвращение планеты на натальную долготу (солярий, лунарий и т. д.);
+  aspect  — точный транзитный аспект к натальному объекту.
+
+Как и при сканировании транзитов (scan.py), каждое тело проходит период
+с собственным шагом по таблице эфемерид, а найденные на сетке смены знака
+уточняются: для долгот (вход в знак, возвращение, аспект) — методом Ньютона
+по долготе и скорости сразу для всех интервалов тела (scan.find_roots), для
+станций — методом хорд (Illinois) по скорости. Поэтому поиск на год вперёд
+занимает десятки миллисекунд вместо расчёта карты на каждый день.
+
+Момент станции определяется с точностью до минут: скорость около станции
+почти не меняется, а погрешность скорости из таблицы — до 0.001°/сутки.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from flatlib import const
+
+from aspects import norm180
+from charts import ASPECT_NAMES, PLANET_IDS, TRANSIT_ASPECTS
+from ephemeris import body_position, body_positions
+from metrics import stage
+from scan import MAX_ITERATIONS, TIME_TOLERANCE, aspect_targets, find_brackets, find_roots, jd_to_iso, step_for
+
+EVENT_TYPES = ("ingress", "station", "return", "aspect")
+
+# Границы знаков: 0°, 30°, ..., 330°
+SIGN_BOUNDARIES = np.arange(12) * 30.0
+
+
+def sign_of(lon: float) -> str:
+    return const.LIST_SIGNS[int(lon % 360.0 / 30)]
+
+
+def crossings(obj_id: str, times: np.ndarray, lons: np.ndarray,
+              target_lons: np.ndarray) -> List[Tuple[int, float, bool]]:
+    """
+    Прохождения телом долгот target_lons: (индекс цели, момент, прямое ли движение).
+
+    Интервалы с корнями находятся по сетке, корни уточняются все вместе (find_roots).
+    """
+    g = norm180(lons[:, None] - target_lons[None, :])
+    steps, cols, h = find_brackets(g)
+    if not len(steps):
+        return []
+    roots = find_roots(obj_id, target_lons[cols], np.zeros(len(cols)), times[steps], times[steps + 1],
+                       h[steps, cols], h[steps + 1, cols])
+    direct = h[steps + 1, cols] >= 0
+    return list(zip(cols.tolist(), roots.tolist(), direct.tolist()))
+
+
+def find_station(obj_id: str, a: float, b: float, sa: float, sb: float) -> float:
+    """
+    Момент t в [a, b], где скорость тела равна нулю.
+
+    sa и sb — скорости на концах, разных знаков. Метод хорд с модификацией
+    Illinois: конец, который не сдвигается два шага подряд, получает вдвое
+    меньший вес, поэтому интервал сжимается с обеих сторон.
+    """
+    side = 0
+    t = (a * sb - b * sa) / (sb - sa)
+    for _ in range(MAX_ITERATIONS):
+        speed = body_position(obj_id, t)[1]
+        if speed == 0.0:
+            return t
+        if (speed < 0) == (sa < 0):
+            a, sa = t, speed
+            if side == -1:
+                sb /= 2
+            side = -1
+        else:
+            b, sb = t, speed
+            if side == 1:
+                sa /= 2
+            side = 1
+        t_next = (a * sb - b * sa) / (sb - sa)
+        if abs(t_next - t) < TIME_TOLERANCE:
+            return t_next
+        t = t_next
+    return t
+
+
+def body_events(obj_id: str, natal_objects: Optional[List[Tuple[str, float, float]]],
+                start_jd: float, end_jd: float, types: Iterable[str]) -> List[Tuple[float, Dict[str, Any]]]:
+    """События одного тела за период: пары (момент в юлианских днях, событие)."""
+    count = max(int(np.ceil((end_jd - start_jd) / step_for(obj_id))), 1)
+    times = np.linspace(start_jd, end_jd, count + 1)
+    lons, speeds = body_positions(obj_id, times)
+    events = []
+
+    if "ingress" in types:
+        for c, t, direct in crossings(obj_id, times, lons, SIGN_BOUNDARIES):
+            # При прямом движении тело входит в знак, который начинается на границе, при ретроградном — в предыдущий
+            sign = const.LIST_SIGNS[c if direct else (c - 1) % 12]
+            events.append((t, {"type": "ingress", "object": obj_id, "sign": sign, "retrograde": not direct}))
+
+    if "station" in types:
+        sign = speeds >= 0
+        for s in np.nonzero(sign[:-1] != sign[1:])[0].tolist():
+            t = find_station(obj_id, float(times[s]), float(times[s + 1]), float(speeds[s]), float(speeds[s + 1]))
+            lon = body_position(obj_id, t)[0]
+            events.append((t, {
+                "type": "station", "object": obj_id,
+                "direction": "direct" if sign[s + 1] else "retrograde",
+                "sign": sign_of(lon), "sign_pos": round(lon % 30, 2),
+            }))
+
+    if natal_objects and "return" in types:
+        natal_lons = np.array([lon for natal_id, lon, _ in natal_objects if natal_id == obj_id])
+        if len(natal_lons):
+            for _, t, direct in crossings(obj_id, times, lons, natal_lons):
+                events.append((t, {"type": "return", "object": obj_id, "retrograde": not direct}))
+
+    if natal_objects and "aspect" in types:
+        # Аспекты к собственной натальной точке не учитываются (соединение — это return), как в scan.py
+        targets = [t for t in aspect_targets(natal_objects, TRANSIT_ASPECTS) if natal_objects[t[0]][0] != obj_id]
+        if targets:
+            for c, t, direct in crossings(obj_id, times, lons, np.array([t[2] for t in targets])):
+                j, k, _ = targets[c]
+                aspect_type = TRANSIT_ASPECTS.types[k]
+                events.append((t, {
+                    "type": "aspect", "object": obj_id,
+                    "aspect": ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}"),
+                    "natal_object": natal_objects[j][0], "retrograde": not direct,
+                }))
+    return events
+
+
+def find_events(natal_objects: Optional[List[Tuple[str, float, float]]], start_jd: float, end_jd: float,
+                utcoffset_minutes: int, types: Iterable[str] = EVENT_TYPES,
+                objects: Iterable[str] = PLANET_IDS) -> List[Dict[str, Any]]:
+    """
+    Задача для пула: события за период [start_jd, end_jd) по времени, с моментами
+    в часовом поясе запроса.
+
+    natal_objects (ChartRecord.objects) нужны только для return и aspect.
+    """
+    types = set(types)
+    found = []
+    with stage("scan"):
+        for obj_id in objects:
+            found.extend(body_events(obj_id, natal_objects, start_jd, end_jd, types))
+    found.sort(key=lambda item: item[0])
+    return [dict(event, moment=jd_to_iso(t, utcoffset_minutes)) for t, event in found if start_jd <= t < end_jd]
@@ -0,0 +1,161 @@
+"""
+Пул для тяжёлых вычислений.
+
+Построение карты (flatlib + Swiss Ephemeris) — синхронный CPU-bound код.
+Если вызывать его прямо из async-обработчика, он блокирует цикл событий
+uvicorn, и все запросы (включая /health) выполняются по очереди. Поэтому
+обработчики отправляют расчёты сюда: в пул процессов по числу ядер
+(или в пул потоков, если процессы недоступны).
+
+Настройки задаются переменными окружения:
+  FLATLIB_EXECUTOR     — "process" (по умолчанию) или "thread"
+  FLATLIB_WORKERS      — число воркеров (по умолчанию число ядер)
+  FLATLIB_MAX_PENDING  — максимум задач в работе и в очереди (по умолчанию workers * 4)
+  FLATLIB_TIMEOUT      — таймаут одного расчёта в секундах (по умолчанию 30)
+  FLATLIB_RETRY_AFTER  — значение заголовка Retry-After при перегрузке (по умолчанию 1)
+"""
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTOR_KIND = os.getenv("FLATLIB_EXECUTOR", "process")
+WORKERS = int(os.getenv("FLATLIB_WORKERS", os.cpu_count() or 1))
+MAX_PENDING = int(os.getenv("FLATLIB_MAX_PENDING", WORKERS * 4))
+TIMEOUT = float(os.getenv("FLATLIB_TIMEOUT", 30))
+RETRY_AFTER = int(os.getenv("FLATLIB_RETRY_AFTER", 1))
+
+
+class ExecutorSaturated(Exception):
+    """Очередь пула заполнена, запрос нужно повторить позже."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Compute queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ComputeTimeout(Exception):
+    """Расчёт не уложился в отведённое время."""
+
+    def __init__(self, timeout: float):
+        super().__init__(f"Computation timed out after {timeout}s")
+        self.timeout = timeout
+
+
+def warm_up():
+    """
+    Инициализирует Swiss Ephemeris в воркере.
+
+    Вызывается один раз при старте каждого процесса (потока) пула, чтобы
+    первый реальный запрос не платил за загрузку эфемерид.
+    """
+    import flatlib
+    from flatlib.ephem import swe
+    from flatlib.datetime import Datetime
+    from flatlib.geopos import GeoPos
+    from flatlib.chart import Chart
+
+    # Путь к файлам эфемерид Swiss Ephemeris хранит отдельно для каждого потока.
+    # Без него swisseph молча переходит на более медленную и менее точную модель Moshier.
+    swe.setPath(flatlib.PATH_RES + 'swefiles')
+    # Таблица эфемерид открывается через mmap: страницы файла общие для всех воркеров
+    from ephemeris import get_table
+    get_table()
+    Chart(Datetime('2000/01/01', '12:00', '+00:00'), GeoPos(0, 0))
+
+
+def worker_info() -> dict:
+    """Задача прогрева: к её запуску warm_up в воркере уже выполнен."""
+    from ephemeris import get_table
+    return {"pid": os.getpid(), "ephemeris": "table" if get_table() is not None else "live"}
+
+
+class ComputeExecutor:
+    """
+    Обёртка над пулом процессов/потоков с ограничением очереди и таймаутом.
+
+    Счётчик задач уменьшается только когда задача реально завершилась в
+    воркере, поэтому задачи, у которых истёк таймаут, продолжают занимать
+    место в очереди, пока не досчитаются.
+    """
+
+    def __init__(self, kind: str = EXECUTOR_KIND, workers: int = WORKERS,
+                 max_pending: int = MAX_PENDING, timeout: float = TIMEOUT,
+                 retry_after: int = RETRY_AFTER):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Число задач, которые выполняются или ждут воркера."""
+        return self._pending
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            try:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+            except (OSError, NotImplementedError, ImportError) as e:
+                logging.warning(f"Process pool is unavailable ({e}), falling back to threads")
+                self.kind = "thread"
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        logging.info(f"Compute executor started: kind={self.kind}, workers={self.workers}, "
+                     f"max_pending={self.max_pending}, timeout={self.timeout}s")
+
+    async def warm(self) -> list:
+        """
+        Запускает воркеры пула и ждёт их инициализации (warm_up) до первого запроса.
+
+        Пул процессов создаёт воркеры при первой задаче, поэтому без прогрева
+        их запуск и загрузку эфемерид оплачивал бы первый запрос. Задачи
+        прогрева не учитываются в очереди и не ограничены таймаутом.
+        """
+        if self._pool is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(loop.run_in_executor(self._pool, worker_info) for _ in range(self.workers)))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """
+        Выполняет fn(*args) в пуле.
+
+        Бросает ExecutorSaturated, если очередь заполнена, и ComputeTimeout,
+        если расчёт не уложился в таймаут.
+        """
+        if self._pool is None:
+            self.start()
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExecutorSaturated(self.retry_after)
+            self._pending += 1
+
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise ComputeTimeout(self.timeout)
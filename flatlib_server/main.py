@@ -1,73 +1,119 @@
+import asyncio
 import logging
-from typing import List, Dict, Any
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Literal, Optional, Union
 
 from flatlib.datetime import Datetime
-from flatlib.geopos import GeoPos
-from flatlib.chart import Chart
 from flatlib import const
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, Request, Response
+from pydantic import BaseModel, Field, ValidationError
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 
+from charts import (
+    PLANET_IDS, SPECIAL_OBJECTS, ANGLE_IDS, ASPECT_TYPES, ASPECT_NAMES, NATAL_OBJECTS, HOUSE_SYSTEMS,
+    DATE_PATTERN, TZ_PATTERN,
+    ChartRecord, natal_key, utcoffset_minutes, compute_natal, compute_synastry,
+    transit_jd, compute_transit_positions, get_transits_for_date, run_batch,
+)
+from cache import ChartCache
+from events import EVENT_TYPES, find_events
+from executor import ComputeExecutor, ExecutorSaturated, ComputeTimeout
+import metrics
+from scan import TimelineStitcher, compute_transit_period, format_event, jd_to_iso, scan_transits
+from result_store import TRIM_INTERVAL, ResultStore
+from serialization import dumps
+from singleflight import SingleFlight
+from streaming import stream_media_type, stream_response
+from transit_calendar import CALENDAR_DAYS, CALENDAR_REFRESH, INDEX_TAG, CalendarStore, Profile
+
 # Настройка логгирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# --- Константы Flatlib ---
-PLANET_IDS = [
-    const.SUN, const.MOON, const.MERCURY, const.VENUS, const.MARS,
-    const.JUPITER, const.SATURN
-]
-SPECIAL_OBJECTS = [
-    const.NORTH_NODE, const.SOUTH_NODE, 
-    const.SYZYGY, 
-    const.PARS_FORTUNA
-]
-ANGLE_IDS = [const.ASC, const.MC]
-ASPECT_TYPES = [
-    const.NO_ASPECT, const.CONJUNCTION, const.OPPOSITION,
-    const.SQUARE, const.TRINE, const.SEXTILE
-]
-ASPECT_NAMES = {
-    const.CONJUNCTION: "Conjunction",
-    const.OPPOSITION: "Opposition",
-    const.SQUARE: "Square",
-    const.TRINE: "Trine",
-    const.SEXTILE: "Sextile"
-}
-TRANSIT_ORBS = {
-    const.CONJUNCTION: 8,
-    const.OPPOSITION: 8,
-    const.SQUARE: 7,
-    const.TRINE: 7,
-    const.SEXTILE: 5,
-}
+# Максимальное число элементов в одном пакетном запросе
+BATCH_MAX_ITEMS = int(os.getenv("FLATLIB_BATCH_MAX", 1000))
+# Потоковая выдача: длина части периода в сутках и число элементов пакета в одной части
+STREAM_CHUNK_DAYS = float(os.getenv("FLATLIB_STREAM_CHUNK_DAYS", 31))
+STREAM_BATCH_SIZE = int(os.getenv("FLATLIB_STREAM_BATCH_SIZE", 64))
+# Максимальная длина периода для /predict/range
+MAX_RANGE_YEARS = 100
+# Максимальный возраст для /predict/progressions
+MAX_PROGRESSION_AGE = 120
+# Поиск событий (/predict/events) идёт частями по столько суток, чтобы при limit остановиться пораньше
+EVENT_CHUNK_DAYS = 366.0
+# /synastry/matrix без top_k возвращает аспекты всех пар только для групп не больше этой
+SYNASTRY_FULL_MAX = int(os.getenv("FLATLIB_SYNASTRY_FULL_MAX", 100))
 
 # --- Pydantic модели ---
 class NatalChartRequest(BaseModel):
-    date: str = Field(..., description="Дата рождения (YYYY/MM/DD)", example="1990/05/03")
+    date: str = Field(..., description="Дата рождения (YYYY/MM/DD)", example="1990/05/03", pattern=DATE_PATTERN)
     time: str = Field(..., description="Время рождения (HH:MM:SS)", example="13:20:00")
-    tz: str = Field(..., description="Часовой пояс (+HH:MM или -HH:MM)", example="+03:00")
+    tz: str = Field(..., description="Часовой пояс (+HH:MM или -HH:MM)", example="+03:00", pattern=TZ_PATTERN)
     lat: float = Field(..., description="Широта", example=56.2575)
     lon: float = Field(..., description="Долгота", example=43.9824)
 
+class NatalChartOptionsRequest(NatalChartRequest):
+    """Натальная карта с выбором того, что считать: ненужное не рассчитывается вовсе."""
+    house_system: Literal[HOUSE_SYSTEMS] = Field(const.HOUSES_PLACIDUS, description="Система домов", example="Whole Sign")
+    objects: Optional[List[Literal[tuple(NATAL_OBJECTS)]]] = Field(
+        None, description="Объекты карты (по умолчанию все)", example=["Sun", "Moon", "Mercury", "Venus", "Mars"])
+    houses: bool = Field(True, description="Считать дома и углы (Asc, MC)")
+    aspects: bool = Field(True, description="Считать аспекты")
+    special: bool = Field(True, description="Считать узлы, Syzygy и Pars Fortuna")
+
 class DailyPredictionRequest(BaseModel):
-    date: str = Field(..., description="Дата рождения (YYYY/MM/DD)", example="1990/05/03")
+    date: str = Field(..., description="Дата рождения (YYYY/MM/DD)", example="1990/05/03", pattern=DATE_PATTERN)
     time: str = Field(..., description="Время рождения (HH:MM:SS)", example="13:20:00")
-    tz: str = Field(..., description="Часовой пояс (+HH:MM или -HH:MM)", example="+03:00")
+    tz: str = Field(..., description="Часовой пояс (+HH:MM или -HH:MM)", example="+03:00", pattern=TZ_PATTERN)
     lat: float = Field(..., description="Широта", example=56.2575)
     lon: float = Field(..., description="Долгота", example=43.9824)
-    target_date: str = Field(..., description="Целевая дата для прогноза (YYYY/MM/DD)", example="2025/08/15")
+    target_date: str = Field(..., description="Целевая дата для прогноза (YYYY/MM/DD)", example="2025/08/15",
+                             pattern=DATE_PATTERN)
 
-class YearlyPredictionRequest(BaseModel):
-    date: str = Field(..., description="Дата рождения (YYYY/MM/DD)", example="1990/05/03")
-    time: str = Field(..., description="Время рождения (HH:MM:SS)", example="13:20:00")
-    tz: str = Field(..., description="Часовой пояс (+HH:MM или -HH:MM)", example="+03:00")
-    lat: float = Field(..., description="Широта", example=56.2575)
-    lon: float = Field(..., description="Долгота", example=43.9824)
-    age: int = Field(..., description="Возраст, на который делается прогноз", example=35)
+class ProgressionRequest(NatalChartRequest):
+    age: Optional[int] = Field(None, ge=0, description="Возраст, на который делается прогноз", example=35)
+    age_from: Optional[int] = Field(None, ge=0, description="Начало диапазона возрастов (вместо age)", example=0)
+    age_to: Optional[int] = Field(None, ge=0, description="Конец диапазона возрастов включительно", example=90)
+
+class ObjectPosition(BaseModel):
+    """Положение планеты или особой точки."""
+    id: str
+    sign: str
+    sign_pos: float
+    lon: float
+    lat: float
+    speed: float
+    retrograde: bool
+
+class PointPosition(BaseModel):
+    """Положение угла или куспида дома."""
+    id: str
+    sign: str
+    sign_pos: float
+    lon: float
+
+class NatalAspect(BaseModel):
+    """Аспект между двумя объектами натальной карты."""
+    id1: str
+    id2: str
+    type: str
+    difference: float
+    orb: float
+    is_applying: bool
+    days_to_exact: Optional[float] = None
+
+class NatalChartResponse(BaseModel):
+    """Модель для ответа с натальной картой."""
+    planets: Dict[str, ObjectPosition]
+    special: Dict[str, ObjectPosition]
+    angles: Dict[str, PointPosition]
+    houses: Dict[str, PointPosition]
+    aspects: List[NatalAspect]
 
 class Transit(BaseModel):
     """Модель для описания одного транзитного аспекта."""
@@ -76,337 +122,1000 @@ class Transit(BaseModel):
     natal_planet: str
     orb: float
     is_applying: bool = False
+    days_to_exact: Optional[float] = Field(None, description="Через сколько суток аспект станет точным (для сходящихся аспектов)")
 
 class TransitsResponse(BaseModel):
     """Модель для ответа с транзитными аспектами."""
     target_date: str
     transits: List[Transit]
-    
+
+class MessageResponse(BaseModel):
+    """Ответ без данных (например, на дату нет транзитов)."""
+    message: str
+
+class RangePredictionRequest(NatalChartRequest):
+    start_date: Optional[str] = Field(None, description="Начало периода прогноза (YYYY-MM-DD), по умолчанию сегодня", example="2025-08-01")
+
+class TimelineRequest(RangePredictionRequest):
+    end_date: str = Field(..., description="Конец периода прогноза (YYYY-MM-DD, не включительно)", example="2030-01-01")
+
+class TransitEvent(BaseModel):
+    """Прохождение транзитного аспекта за период: вход в орб, точные моменты и выход."""
+    transit_planet: str
+    aspect: str
+    natal_planet: str
+    entry: Optional[str] = Field(None, description="Вход в орб (None — аспект уже действует в начале периода)")
+    exact: List[str] = Field(default_factory=list, description="Моменты точного аспекта (несколько при ретроградности)")
+    exit: Optional[str] = Field(None, description="Выход из орба (None — аспект ещё действует в конце периода)")
+    orb: float = Field(..., description="Наименьший орб за период (0 — аспект стал точным)")
+
+class TransitPeriodResponse(BaseModel):
+    """Модель для ответа с транзитами за период."""
+    start_date: str
+    end_date: str
+    transits: List[TransitEvent]
+
+class Progression(BaseModel):
+    """Аспект прогрессивной планеты к натальному объекту."""
+    progressed_planet: str
+    aspect: str
+    natal_planet: str
+    orb: float
+    is_applying: bool
+    years_to_exact: Optional[float] = Field(None, description="Через сколько лет аспект станет точным (для сходящихся аспектов)")
+
+class AgeProgressions(BaseModel):
+    age: int
+    progressed_date: str = Field(..., description="Дата прогрессивной карты (рождение + age суток)")
+    progressions: List[Progression]
+
+class ProgressionsResponse(BaseModel):
+    """Модель для ответа с прогрессиями по возрастам."""
+    progressions: List[AgeProgressions]
+
+class EventSearchRequest(RangePredictionRequest):
+    end_date: Optional[str] = Field(None, description="Конец поиска (YYYY-MM-DD, не включительно), по умолчанию через год после start_date", example="2026-08-01")
+    types: Optional[List[Literal[EVENT_TYPES]]] = Field(None, description="Типы событий (по умолчанию все)", example=["station", "ingress"])
+    objects: Optional[List[Literal[tuple(PLANET_IDS)]]] = Field(None, description="Планеты (по умолчанию все PLANET_IDS)", example=["Mercury", "Mars"])
+    limit: Optional[int] = Field(None, ge=1, description="Вернуть только первые limit событий", example=1)
+
+class AstroEvent(BaseModel):
+    """Событие: поля sign..retrograde заполнены в зависимости от типа."""
+    type: str = Field(..., description="ingress, station, return или aspect")
+    object: str
+    moment: str = Field(..., description="Точный момент (ISO 8601 в часовом поясе запроса)")
+    sign: Optional[str] = Field(None, description="ingress — знак, в который входит планета; station — знак станции")
+    sign_pos: Optional[float] = Field(None, description="station — положение в знаке")
+    direction: Optional[str] = Field(None, description="station — retrograde или direct")
+    aspect: Optional[str] = Field(None, description="aspect — тип аспекта")
+    natal_object: Optional[str] = Field(None, description="aspect — натальный объект")
+    retrograde: Optional[bool] = Field(None, description="ingress, return, aspect — планета ретроградна")
+
+class EventSearchResponse(BaseModel):
+    start_date: str
+    end_date: str
+    events: List[AstroEvent]
+
+class CalendarProfileResponse(BaseModel):
+    """Профиль календаря и рассчитанное окно (даты в часовом поясе профиля)."""
+    profile_id: str
+    window_start: Optional[str] = None
+    window_end: Optional[str] = None
+
+class CalendarDayResponse(BaseModel):
+    """Транзиты профиля, действующие в течение суток date."""
+    profile_id: str
+    date: str
+    transits: List[TransitEvent]
+
 class SynastryRequest(BaseModel):
     """Модель для запроса синастрии (две натальные карты)."""
     person1: NatalChartRequest
     person2: NatalChartRequest
 
-# --- Вспомогательные функции ---
-def get_planet_data(obj):
-    is_retrograde = obj.isRetrograde
-    if callable(is_retrograde):
-        is_retrograde = is_retrograde()
-    return {
-        "id": obj.id,
-        "sign": obj.sign,
-        "sign_pos": round(obj.signlon, 2),
-        "lon": round(obj.lon, 4),
-        "lat": round(obj.lat, 4),
-        "speed": round(obj.lonspeed, 4),
-        "retrograde": bool(is_retrograde)
-    }
-
-def get_special_object_data(obj):
-    is_retrograde = obj.isRetrograde
-    if callable(is_retrograde):
-        is_retrograde = is_retrograde()
-    return {
-        "id": obj.id,
-        "sign": obj.sign,
-        "sign_pos": round(obj.signlon, 2),
-        "lon": round(obj.lon, 4),
-        "lat": round(obj.lat, 4),
-        "speed": round(obj.lonspeed, 4),
-        "retrograde": bool(is_retrograde)
-    }
-
-def get_angle_data(obj):
-    return {
-        "id": obj.id,
-        "sign": obj.sign,
-        "sign_pos": round(obj.signlon, 2),
-        "lon": round(obj.lon, 4)
-    }
+class SynastryAspect(BaseModel):
+    """Аспект между объектами двух карт."""
+    person1_object: str
+    aspect: str
+    person2_object: str
+    orb: float
+    is_applying: bool
+    days_to_exact: Optional[float] = None
 
-def get_house_data(house):
-    return {
-        "id": house.id,
-        "sign": house.sign,
-        "sign_pos": round(house.signlon, 2),
-        "lon": round(house.lon, 4)
-    }
-
-def calculate_aspects(chart):
-    """Рассчитывает аспекты между всеми объектами карты."""
-    aspects = []
-    
-    all_objects = []
-    for o_id in PLANET_IDS + SPECIAL_OBJECTS + ANGLE_IDS:
-        try:
-            obj = chart.get(o_id)
-            all_objects.append(obj)
-        except:
-            continue
-    
-    ORBS = {const.CONJUNCTION: 8.0, const.OPPOSITION: 8.0, const.SQUARE: 6.0, const.TRINE: 6.0, const.SEXTILE: 4.0}
-    EXACT_ANGLES = {const.CONJUNCTION: 0, const.SEXTILE: 60, const.SQUARE: 90, const.TRINE: 120, const.OPPOSITION: 180}
-    
-    for i in range(len(all_objects)):
-        for j in range(i + 1, len(all_objects)):
-            obj1, obj2 = all_objects[i], all_objects[j]
-            distance = abs(obj1.lon - obj2.lon)
-            if distance > 180:
-                distance = 360 - distance
-            
-            for aspect_type, max_orb in ORBS.items():
-                exact_angle = EXACT_ANGLES[aspect_type]
-                orb = abs(distance - exact_angle)
-                
-                if orb > 180:
-                    orb = 360 - orb
-                
-                if orb <= max_orb:
-                    aspect_name = ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}")
-                    aspects.append({
-                        "id1": obj1.id, "id2": obj2.id, "type": aspect_name,
-                        "difference": round(distance, 4), "orb": round(orb, 4)
-                    })
-                    break
-    return aspects
-    
-def get_transits_for_date(natal_data: dict, target_date: str) -> List[Dict[str, Any]]:
+class SynastryResponse(BaseModel):
+    synastry_aspects: List[SynastryAspect]
+
+class SynastryMatrixRequest(BaseModel):
+    """Группа профилей для попарной синастрии."""
+    profiles: List[NatalChartRequest] = Field(..., min_length=2)
+    top_k: Optional[int] = Field(None, ge=0, description="Сколько лучших партнёров каждого профиля вернуть "
+                                                         "со списком аспектов (0 — только матрица оценок)", example=5)
+
+class SynastryPair(BaseModel):
+    """Пара профилей (индексы в profiles) с оценкой совместимости и аспектами."""
+    person1: int
+    person2: int
+    score: float
+    synastry_aspects: List[SynastryAspect]
+
+class SynastryMatrixResponse(BaseModel):
+    """Матрица оценок совместимости (на диагонали null) и выбранные пары по убыванию оценки."""
+    scores: List[List[Optional[float]]]
+    pairs: List[SynastryPair]
+
+class BatchItem(BaseModel):
+    """Элемент пакетного ответа: результат или ошибка элемента с индексом index."""
+    index: int
+    result: Optional[Any] = None
+    error: Optional[str] = None
+
+class BatchNatalItem(BatchItem):
+    result: Optional[NatalChartResponse] = None
+
+class BatchTransitsItem(BatchItem):
+    result: Optional[Union[TransitsResponse, MessageResponse]] = None
+
+class BatchNatalResponse(BaseModel):
+    results: List[BatchNatalItem]
+
+class BatchTransitsResponse(BaseModel):
+    results: List[BatchTransitsItem]
+
+# --- FastAPI-приложение ---
+executor = ComputeExecutor()
+natal_cache = ChartCache("natal")
+transit_cache = ChartCache("transit")
+# Одинаковые одновременные расчёты выполняются один раз (см. singleflight.py)
+natal_flights = SingleFlight("natal")
+transit_flights = SingleFlight("transit")
+daily_flights = SingleFlight("daily")
+calendar_flights = SingleFlight("calendar")
+calendar_store = CalendarStore()
+result_store = ResultStore()
+# Состояние прогрева пула для /ready: starting -> ready (или failed)
+readiness: Dict[str, Any] = {"status": "starting"}
+
+async def warm_up_executor():
+    """Фоновая задача: запускает воркеры пула и загружает эфемериды до первого запроса."""
+    started = time.perf_counter()
+    try:
+        workers = await executor.warm()
+    except Exception as e:
+        logging.error(f"Compute executor warm-up failed: {e}", exc_info=True)
+        readiness.update(status="failed", error=str(e))
+        return
+    readiness.update(status="ready", workers=len(workers), ephemeris=workers[0]["ephemeris"],
+                     warm_up_seconds=round(time.perf_counter() - started, 3))
+    logging.info(f"Compute executor is ready in {readiness['warm_up_seconds']}s")
+
+async def trim_result_store_periodically():
+    """Фоновая задача: раз в TRIM_INTERVAL секунд удерживает хранилище результатов в пределах лимита."""
+    while True:
+        await asyncio.to_thread(result_store.trim)
+        await asyncio.sleep(TRIM_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executor.start()
+    # Прогрев идёт в фоне: /health отвечает сразу, /ready — после прогрева
+    warming = asyncio.create_task(warm_up_executor())
+    calendar_store.open()
+    result_store.open()
+    refresher = asyncio.create_task(refresh_calendars_periodically())
+    trimmer = asyncio.create_task(trim_result_store_periodically())
+    yield
+    warming.cancel()
+    refresher.cancel()
+    trimmer.cancel()
+    executor.shutdown()
+    calendar_store.close()
+    result_store.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    """Счётчик запросов и гистограмма задержки по эндпоинтам, заголовок Server-Timing."""
+    started = time.perf_counter()
+    stages = metrics.start_request()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        # Шаблон пути маршрута, а не сам путь, чтобы не плодить метки; для неизвестных путей — "unmatched"
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        metrics.REQUESTS.inc(request.method, endpoint, str(status))
+        metrics.REQUEST_LATENCY.observe(elapsed, request.method, endpoint)
+    if metrics.SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(stages, elapsed)
+    return response
+
+def collect_runtime_metrics():
+    """Состояние кэшей и пула на момент запроса /metrics."""
+    caches = [(cache.name, cache.stats()) for cache in (natal_cache, transit_cache)]
+    for key, metric_type, documentation in (
+        ("entries", "gauge", "Entries in the cache."),
+        ("bytes", "gauge", "Approximate memory used by the cache, in bytes."),
+        ("hits", "counter", "Cache hits."),
+        ("misses", "counter", "Cache misses."),
+        ("evictions", "counter", "Evicted or expired cache entries."),
+        ("hit_ratio", "gauge", "Share of lookups served from the cache."),
+    ):
+        name = f"flatlib_cache_{key}" + ("_total" if metric_type == "counter" else "")
+        yield name, metric_type, documentation, [({"cache": cache}, stats[key]) for cache, stats in caches]
+    flights = (natal_flights, transit_flights, daily_flights, calendar_flights)
+    yield ("flatlib_coalesced_requests_total", "counter",
+           "Requests that waited for an identical calculation already in progress instead of starting their own.",
+           [({"kind": flight.name}, flight.coalesced) for flight in flights])
+    yield ("flatlib_inflight_calculations", "gauge", "Distinct calculations in progress.",
+           [({"kind": flight.name}, len(flight)) for flight in flights])
+    store = result_store.stats()
+    for key, metric_type, documentation in (
+        ("bytes", "gauge", "Size of the results saved in the persistent store, in bytes."),
+        ("hits", "counter", "Results loaded from the persistent store instead of being calculated."),
+        ("misses", "counter", "Persistent store lookups that found nothing."),
+        ("writes", "counter", "Results saved to the persistent store."),
+        ("evictions", "counter", "Results removed from the persistent store to stay within its size limit."),
+        ("errors", "counter", "Failed persistent store reads and writes."),
+    ):
+        name = f"flatlib_store_{key}" + ("_total" if metric_type == "counter" else "")
+        yield name, metric_type, documentation, [({}, store[key])]
+    yield "flatlib_executor_pending", "gauge", "Calculations running or waiting for a worker.", [({}, executor.pending)]
+    yield "flatlib_executor_max_pending", "gauge", "Compute queue capacity.", [({}, executor.max_pending)]
+    yield "flatlib_executor_workers", "gauge", "Compute workers.", [({"kind": executor.kind}, executor.workers)]
+
+metrics.REGISTRY.register_collector(collect_runtime_metrics)
+
+async def run_compute(fn, *args):
     """
-    Рассчитывает транзитные аспекты на конкретную дату, используя старый метод.
+    Выполняет расчёт в пуле, не блокируя цикл событий.
+
+    Переполнение очереди превращается в 503 с Retry-After, таймаут — в 504.
     """
+    started = time.perf_counter()
     try:
-        # 1. Создаём натальную карту
-        birth_date = Datetime(natal_data['date'].replace("-", "/"), natal_data['time'], natal_data['tz'])
-        birth_pos = GeoPos(natal_data['lat'], natal_data['lon'])
-        natal_chart = Chart(birth_date, birth_pos)
-
-        # 2. Создаём транзитную карту на текущую дату
-        transit_date = Datetime(target_date.replace("-", "/"), '12:00:00', natal_data['tz'])
-        transit_pos = birth_pos
-        transit_chart = Chart(transit_date, transit_pos)
-
-        transits = []
-        
-        # 3. Получаем списки объектов из обеих карт
-        natal_objects = natal_chart.objects
-        transit_objects = transit_chart.objects
-
-        # 4. Вручную рассчитываем аспекты между транзитными и натальными объектами
-        for transit_obj in transit_objects:
-            for natal_obj in natal_objects:
-                # Проверяем, что это не один и тот же объект в разных картах
-                if transit_obj.id == natal_obj.id:
-                    continue
-
-                distance = abs(transit_obj.lon - natal_obj.lon)
-                if distance > 180:
-                    distance = 360 - distance
-
-                for aspect_type, max_orb in TRANSIT_ORBS.items():
-                    # Рассчитываем точный угол для каждого аспекта
-                    if aspect_type == const.CONJUNCTION:
-                        exact_angle = 0
-                    elif aspect_type == const.OPPOSITION:
-                        exact_angle = 180
-                    elif aspect_type == const.SQUARE:
-                        exact_angle = 90
-                    elif aspect_type == const.TRINE:
-                        exact_angle = 120
-                    elif aspect_type == const.SEXTILE:
-                        exact_angle = 60
-                    else:
-                        continue # Пропускаем, если аспект не поддерживается
-
-                    orb = abs(distance - exact_angle)
-                    
-                    if orb <= max_orb:
-                        aspect_name = ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}")
-                        transits.append({
-                            'transit_planet': transit_obj.id,
-                            'aspect': aspect_name, # Используем человекочитаемое имя
-                            'natal_planet': natal_obj.id,
-                            'orb': round(orb, 2),
-                            # Упрощенная логика is_applying. Можно доработать
-                            'is_applying': False, 
-                        })
-                        break
-        return transits
-    except Exception as e:
-        # Добавляем логгирование для более детальной информации об ошибке
-        logging.error(f"Error in get_transits_for_date: {e}", exc_info=True)
-        raise e
+        result, stages = await executor.run(metrics.timed_call, fn, *args)
+    except ExecutorSaturated as e:
+        metrics.EXECUTOR_REJECTED.inc()
+        logging.warning(f"Compute queue is full ({executor.pending} pending), rejecting request")
+        raise HTTPException(status_code=503, detail="Server is busy, please retry later",
+                            headers={"Retry-After": str(e.retry_after)})
+    except ComputeTimeout as e:
+        metrics.EXECUTOR_TIMEOUTS.inc()
+        logging.error(str(e))
+        raise HTTPException(status_code=504, detail="Calculation timed out")
+    # Ожидание в очереди и передача данных между процессами — всё, что не заняла сама задача
+    task_seconds = stages[-1][1]
+    metrics.record_stages(stages + [("queue", max(time.perf_counter() - started - task_seconds, 0.0))])
+    return result
 
-# --- FastAPI-приложение ---
-app = FastAPI()
+async def get_natal_entry(natal_data: dict) -> ChartRecord:
+    """
+    Натальная карта из кэша или, при промахе, рассчитанная в пуле.
+
+    Одновременные промахи по одному ключу ждут один общий расчёт.
+    """
+    key = natal_key(natal_data)
+    entry = natal_cache.get(key)
+    if entry is None:
+        entry = await natal_flights.do(key, lambda: compute_natal_entry(key, natal_data))
+    return entry
+
+async def compute_natal_entry(key: tuple, natal_data: dict) -> ChartRecord:
+    entry = await asyncio.to_thread(result_store.get, "natal", key)
+    if entry is None:
+        entry = await run_compute(compute_natal, natal_data)
+        await asyncio.to_thread(result_store.put, "natal", key, entry)
+    natal_cache.put(key, entry)
+    return entry
+
+async def get_transit_positions(natal_data: dict, target_date: str):
+    """
+    Положения транзитных объектов на полдень target_date.
+
+    Они не зависят от натальной карты, поэтому кэшируются по моменту времени
+    и переиспользуются всеми пользователями с тем же часовым поясом.
+    """
+    jd = transit_jd(target_date, natal_data['tz'])
+    positions = transit_cache.get(jd)
+    if positions is None:
+        positions = await transit_flights.do(jd, lambda: compute_transit_entry(jd))
+    return positions
+
+async def compute_transit_entry(jd: float):
+    positions = await asyncio.to_thread(result_store.get, "transit", jd)
+    if positions is None:
+        positions = await run_compute(compute_transit_positions, jd)
+        await asyncio.to_thread(result_store.put, "transit", jd, positions)
+    transit_cache.put(jd, positions)
+    return positions
+
+async def compute_transits(natal_data: dict, target_date: str):
+    """
+    Транзитные аспекты на target_date из кэшированных натальных и транзитных положений.
+
+    Результат не кэшируется, но одинаковые одновременные запросы (тот же
+    субъект и момент) считаются один раз.
+    """
+    key = (natal_key(natal_data), transit_jd(target_date, natal_data['tz']))
+    return await daily_flights.do(key, lambda: match_transits(natal_data, target_date))
+
+async def match_transits(natal_data: dict, target_date: str):
+    entry = await get_natal_entry(natal_data)
+    positions = await get_transit_positions(natal_data, target_date)
+    return await run_compute(get_transits_for_date, natal_data, target_date, entry.objects, positions)
+
+# --- Пакетные расчёты ---
+async def run_batch_compute(fn, args_list: List[tuple]):
+    """
+    Делит задачи на части по числу воркеров и считает их параллельно.
 
-@app.post("/natal", response_model=Dict[str, Any])
-async def get_natal_chart(request: NatalChartRequest):
+    Каждая часть — одна задача пула, поэтому большой пакет занимает не больше
+    executor.workers мест в очереди. Возвращает пары (результат, ошибка).
+    """
+    if not args_list:
+        return []
+    size = -(-len(args_list) // executor.workers)
+    chunks = [args_list[i:i + size] for i in range(0, len(args_list), size)]
+    parts = await asyncio.gather(*(run_compute(run_batch, fn, chunk) for chunk in chunks))
+    return [item for part in parts for item in part]
+
+async def get_natal_entries(items: List[dict]) -> Dict[tuple, tuple]:
+    """
+    Натальные карты для пакета: одинаковые субъекты считаются один раз,
+    закэшированные (в памяти или в хранилище) не считаются вовсе.
+    Возвращает {natal_key: (entry, ошибка)}.
+    """
+    resolved, missing = {}, {}
+    for natal_data in items:
+        key = natal_key(natal_data)
+        if key in resolved or key in missing:
+            continue
+        entry = natal_cache.get(key)
+        if entry is not None:
+            resolved[key] = (entry, None)
+        else:
+            missing[key] = natal_data
+
+    saved = await asyncio.to_thread(result_store.get_many, "natal", missing)
+    for key, entry in saved.items():
+        natal_cache.put(key, entry)
+        resolved[key] = (entry, None)
+        del missing[key]
+
+    computed = await run_batch_compute(compute_natal, [(natal_data,) for natal_data in missing.values()])
+    stored = {}
+    for key, (entry, error) in zip(missing, computed):
+        if entry is not None:
+            natal_cache.put(key, entry)
+            stored[key] = entry
+        resolved[key] = (entry, error)
+    await asyncio.to_thread(result_store.put_many, "natal", stored)
+    return resolved
+
+async def get_transit_positions_batch(jds: List[float]) -> Dict[float, tuple]:
+    """Транзитные положения для набора моментов (без повторов). Возвращает {jd: (positions, ошибка)}."""
+    resolved, missing = {}, []
+    for jd in dict.fromkeys(jds):
+        positions = transit_cache.get(jd)
+        if positions is not None:
+            resolved[jd] = (positions, None)
+        else:
+            missing.append(jd)
+
+    saved = await asyncio.to_thread(result_store.get_many, "transit", missing)
+    for jd, positions in saved.items():
+        transit_cache.put(jd, positions)
+        resolved[jd] = (positions, None)
+    missing = [jd for jd in missing if jd not in resolved]
+
+    computed = await run_batch_compute(compute_transit_positions, [(jd,) for jd in missing])
+    stored = {}
+    for jd, (positions, error) in zip(missing, computed):
+        if positions is not None:
+            transit_cache.put(jd, positions)
+            stored[jd] = positions
+        resolved[jd] = (positions, error)
+    await asyncio.to_thread(result_store.put_many, "transit", stored)
+    return resolved
+
+def validate_batch(items: List[Dict[str, Any]], model) -> List[tuple]:
+    """Проверяет элементы пакета по отдельности: [(данные, ошибка)]."""
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch is too large (max {BATCH_MAX_ITEMS} items)")
+    validated = []
+    for item in items:
+        try:
+            validated.append((model(**item).dict(), None))
+        except (ValidationError, TypeError) as e:
+            validated.append((None, str(e)))
+    return validated
+
+def json_response(content: Any) -> Response:
+    """
+    JSON-ответ из словаря или готовых байтов (serialization.dumps).
+
+    FastAPI не проверяет такой ответ повторно через response_model (модель
+    остаётся в документации OpenAPI): данные рассчитаны нашим же кодом.
+    """
+    return Response(content if isinstance(content, bytes) else dumps(content), media_type="application/json")
+
+def batch_item(index: int, outcome: tuple) -> Dict[str, Any]:
+    result, error = outcome
+    return {"index": index, "error": error} if error is not None else {"index": index, "result": result}
+
+def batch_response(outcomes: List[tuple]) -> Response:
+    """Ответ пакетного эндпоинта: результаты в порядке запроса, с ошибками по элементам."""
+    return json_response({"results": [batch_item(i, outcome) for i, outcome in enumerate(outcomes)]})
+
+@app.post("/natal", response_model=NatalChartResponse)
+async def get_natal_chart(request: NatalChartOptionsRequest):
     """
     Эндпоинт для расчета натальной карты.
+
+    house_system, objects, houses, aspects и special задают, что считать;
+    например, только долготы планет: {"houses": false, "aspects": false, "special": false}.
     """
     try:
-        date_str = request.date.replace("-", "/")
-        dt = Datetime(date_str, request.time, request.tz)
-        pos = GeoPos(request.lat, request.lon)
-        
-        logging.info(f"Calculating chart for date='{dt}', pos=({request.lat}, {request.lon})")
-        
-        chart = Chart(dt, pos, hsys=const.HOUSES_PLACIDUS)
-        
-        result = {}
-        result['planets'] = {obj.id: get_planet_data(chart.get(obj.id)) for obj in chart.objects if obj.id in PLANET_IDS}
-        result['special'] = {obj.id: get_special_object_data(chart.get(obj.id)) for obj in chart.objects if obj.id in SPECIAL_OBJECTS}
-        
-        angles = {}
-        for angle_id in ANGLE_IDS:
-            try:
-                angle_obj = chart.get(angle_id)
-                angles[angle_id] = get_angle_data(angle_obj)
-            except Exception as e:
-                logging.warning(f"Could not get angle {angle_id}: {e}")
-                
-        result['angles'] = angles
-        
-        result['houses'] = {f"House {h.id}": get_house_data(h) for h in chart.houses}
-        result['aspects'] = calculate_aspects(chart)
-        
-        return result
-        
+        entry = await get_natal_entry(request.dict())
+        return json_response(entry.json)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="An internal error occurred")
 
 
-@app.post("/predict/daily", response_model=Dict[str, Any])
+@app.post("/predict/daily", response_model=Union[TransitsResponse, MessageResponse])
 async def predict_daily(request: DailyPredictionRequest):
     """
     Эндпоинт для расчета ежедневных транзитов.
     """
     try:
-        transits = get_transits_for_date(request.dict(), request.target_date)
+        transits = await compute_transits(request.dict(), request.target_date)
         if not transits:
-            return {"message": "На указанную дату значимых транзитных аспектов не найдено."}
-        return {"target_date": request.target_date, "transits": transits}
+            return json_response({"message": "На указанную дату значимых транзитных аспектов не найдено."})
+        return json_response({"target_date": request.target_date, "transits": transits})
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
     
 
-# Новый эндпоинт для месячного прогноза
-@app.post("/predict/monthly", response_model=TransitsResponse)
-async def predict_monthly(request: NatalChartRequest):
+def resolve_period(request: RangePredictionRequest, period: Optional[relativedelta] = None):
     """
-    Расчет транзитов на первый день следующего месяца для месячного прогноза.
+    Границы периода прогноза: (start, end, start_jd, end_jd, смещение tz в минутах).
+
+    Начало — start_date или сегодняшний день в часовом поясе запроса; конец —
+    start + period или end_date запроса.
     """
-    try:
-        # Получаем дату натальной карты
-        natal_datetime = Datetime(request.date.replace("-", "/"), request.time, request.tz)
+    offset = utcoffset_minutes(request.tz)
+    if offset is None:
+        raise ValueError(f"Invalid time zone: {request.tz}")
+
+    if request.start_date:
+        start = datetime.strptime(request.start_date.replace("/", "-"), "%Y-%m-%d").date()
+    else:
+        start = datetime.now(timezone(timedelta(minutes=offset))).date()
+    if period is not None:
+        end = start + period
+    else:
+        end = datetime.strptime(request.end_date.replace("/", "-"), "%Y-%m-%d").date()
+        if not start < end <= start + relativedelta(years=MAX_RANGE_YEARS):
+            raise HTTPException(status_code=400, detail=f"end_date must be after start_date and within {MAX_RANGE_YEARS} years")
+
+    start_jd = Datetime(start.strftime("%Y/%m/%d"), '00:00:00', request.tz).jd
+    end_jd = Datetime(end.strftime("%Y/%m/%d"), '00:00:00', request.tz).jd
+    return start, end, start_jd, end_jd, offset
 
-        # Вычисляем дату следующего месяца
-        current_date = datetime.strptime(request.date, "%Y-%m-%d").date()
-        next_month_date = current_date.replace(day=1) + relativedelta(months=1)
-        target_date_str = next_month_date.strftime("%Y-%m-%d")
+async def iter_transit_period(natal_objects, start_jd: float, end_jd: float, offset: int):
+    """
+    События транзитов за период, по частям по STREAM_CHUNK_DAYS суток.
+
+    Каждая часть — отдельная задача пула; завершившиеся прохождения отдаются
+    сразу, незавершённые склеиваются со следующей частью (TimelineStitcher).
+    """
+    stitcher = TimelineStitcher()
+    chunk_start = start_jd
+    while chunk_start < end_jd:
+        chunk_end = min(chunk_start + STREAM_CHUNK_DAYS, end_jd)
+        events = await run_compute(scan_transits, natal_objects, chunk_start, chunk_end)
+        for event in stitcher.feed(events):
+            yield format_event(event, offset)
+        chunk_start = chunk_end
+    for event in stitcher.finish():
+        yield format_event(event, offset)
+
+async def predict_period(request: RangePredictionRequest, http_request: Request,
+                         period: Optional[relativedelta] = None):
+    """
+    Транзиты за период: вход в орб, точные аспекты и выход из орба (см. scan.py).
+
+    При Accept: application/x-ndjson или text/event-stream события
+    отдаются потоком по мере расчёта.
+    """
+    start, end, start_jd, end_jd, offset = resolve_period(request, period)
+    entry = await get_natal_entry(request.dict())
 
-        # Получаем транзиты для этой даты
-        transits = get_transits_for_date(request.dict(), target_date_str)
+    media_type = stream_media_type(http_request)
+    if media_type:
+        return stream_response(iter_transit_period(entry.objects, start_jd, end_jd, offset), media_type)
 
-        return {"target_date": target_date_str, "transits": transits}
+    if period is not None:
+        transits = await run_compute(compute_transit_period, entry.objects, start_jd, end_jd, offset)
+    else:
+        # Длинный период считается частями, чтобы не упираться в таймаут одной задачи
+        transits = [event async for event in iter_transit_period(entry.objects, start_jd, end_jd, offset)]
+        transits.sort(key=lambda e: (e['entry'] is not None, e['entry'] or ''))
+    return json_response({"start_date": start.isoformat(), "end_date": end.isoformat(), "transits": transits})
+
+
+# Новый эндпоинт для месячного прогноза
+@app.post("/predict/monthly", response_model=TransitPeriodResponse)
+async def predict_monthly(request: RangePredictionRequest, http_request: Request):
+    """
+    Транзиты на месяц вперёд от start_date (по умолчанию — от сегодняшнего дня).
+    """
+    try:
+        return await predict_period(request, http_request, relativedelta(months=1))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error(f"Error in predict_monthly: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="An internal error occurred while processing monthly prediction.")
 
 
 # Новый эндпоинт для годового прогноза
-@app.post("/predict/yearly", response_model=TransitsResponse)
-async def predict_yearly(request: NatalChartRequest):
+@app.post("/predict/yearly", response_model=TransitPeriodResponse)
+async def predict_yearly(request: RangePredictionRequest, http_request: Request):
     """
-    Расчет транзитов на 1 января следующего года для годового прогноза.
+    Транзиты на год вперёд от start_date (по умолчанию — от сегодняшнего дня).
     """
     try:
-        # Получаем дату натальной карты
-        natal_datetime = Datetime(request.date.replace("-", "/"), request.time, request.tz)
+        return await predict_period(request, http_request, relativedelta(years=1))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in predict_yearly: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while processing yearly prediction.")
+
+
+@app.post("/predict/range", response_model=TransitPeriodResponse)
+async def predict_range(request: TimelineRequest, http_request: Request):
+    """
+    Транзиты за произвольный период [start_date, end_date) — для многолетних таймлайнов.
+    Лучше запрашивать потоком (Accept: application/x-ndjson).
+    """
+    try:
+        return await predict_period(request, http_request)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in predict_range: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while processing range prediction.")
 
-        # Вычисляем дату следующего года
-        current_date = datetime.strptime(request.date, "%Y-%m-%d").date()
-        next_year_date = current_date.replace(month=1, day=1) + relativedelta(years=1)
-        target_date_str = next_year_date.strftime("%Y-%m-%d")
+@app.post("/predict/progressions", response_model=ProgressionsResponse)
+async def predict_progressions(request: ProgressionRequest):
+    """
+    Вторичные прогрессии (сутки за год): аспекты прогрессивных планет к
+    натальным с орбом 1° для одного возраста (age) или диапазона (age_from..age_to).
+    """
+    try:
+        if request.age is not None and request.age_from is None and request.age_to is None:
+            ages = [request.age]
+        elif request.age is None and request.age_from is not None and request.age_to is not None:
+            ages = list(range(request.age_from, request.age_to + 1))
+        else:
+            raise HTTPException(status_code=400, detail="Specify either age or both age_from and age_to")
+        if not ages or ages[-1] > MAX_PROGRESSION_AGE:
+            raise HTTPException(status_code=400, detail=f"Ages must be an increasing range up to {MAX_PROGRESSION_AGE}")
 
-        # Получаем транзиты для этой даты
-        transits = get_transits_for_date(request.dict(), target_date_str)
+        offset = utcoffset_minutes(request.tz)
+        if offset is None:
+            raise HTTPException(status_code=400, detail=f"Invalid time zone: {request.tz}")
 
-        return {"target_date": target_date_str, "transits": transits}
+        # Модуль нужен только этому эндпоинту и импортируется при первом запросе
+        from progressions import compute_progressions
+
+        natal_data = request.dict()
+        entry = await get_natal_entry(natal_data)
+        progressions = await run_compute(compute_progressions, natal_data, entry.objects, ages, offset)
+        return json_response({"progressions": progressions})
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error in predict_yearly: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail="An internal error occurred while processing yearly prediction.")
+        logging.error(f"Error in predict_progressions: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while processing progressions.")
+
+async def iter_events(natal_objects, start_jd: float, end_jd: float, offset: int,
+                      types: List[str], objects: List[str], limit: Optional[int]):
+    """События по времени, частями по EVENT_CHUNK_DAYS суток; после limit событий поиск прекращается."""
+    count = 0
+    chunk_start = start_jd
+    while chunk_start < end_jd:
+        chunk_end = min(chunk_start + EVENT_CHUNK_DAYS, end_jd)
+        for event in await run_compute(find_events, natal_objects, chunk_start, chunk_end, offset, types, objects):
+            yield event
+            count += 1
+            if limit is not None and count >= limit:
+                return
+        chunk_start = chunk_end
+
+@app.post("/predict/events", response_model=EventSearchResponse)
+async def predict_events(request: EventSearchRequest, http_request: Request):
+    """
+    Точные моменты событий: входы планет в знаки, станции, возвращения на
+    натальные долготы (солярии, лунарии) и точные транзитные аспекты к натальной карте.
+
+    Период — от start_date (по умолчанию сегодня) до end_date (по умолчанию
+    через год). Например, ближайший лунарий: {"types": ["return"], "objects": ["Moon"], "limit": 1}.
+    """
+    try:
+        period = None if request.end_date else relativedelta(years=1)
+        start, end, start_jd, end_jd, offset = resolve_period(request, period)
+        types = list(request.types or EVENT_TYPES)
+        objects = list(request.objects or PLANET_IDS)
+
+        # Натальная карта нужна только для возвращений и аспектов
+        natal_objects = None
+        if "return" in types or "aspect" in types:
+            natal_objects = (await get_natal_entry(request.dict())).objects
+
+        events = iter_events(natal_objects, start_jd, end_jd, offset, types, objects, request.limit)
+        media_type = stream_media_type(http_request)
+        if media_type:
+            return stream_response(events, media_type)
+        return json_response({"start_date": start.isoformat(), "end_date": end.isoformat(),
+                              "events": [event async for event in events]})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in predict_events: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while searching events.")
 
 # Новый эндпоинт для синастрии
-@app.post("/synastry", response_model=Dict[str, Any])
+@app.post("/synastry", response_model=SynastryResponse)
 async def synastry(request: SynastryRequest):
     """
     Расчет синастрических аспектов между двумя натальными картами.
     """
     try:
-        # 1. Создаем натальную карту для первого человека
-        person1_date = Datetime(request.person1.date.replace("-", "/"), request.person1.time, request.person1.tz)
-        person1_pos = GeoPos(request.person1.lat, request.person1.lon)
-        person1_chart = Chart(person1_date, person1_pos)
-
-        # 2. Создаем натальную карту для второго человека
-        person2_date = Datetime(request.person2.date.replace("-", "/"), request.person2.time, request.person2.tz)
-        person2_pos = GeoPos(request.person2.lat, request.person2.lon)
-        person2_chart = Chart(person2_date, person2_pos)
-
-        synastry_aspects = []
-
-        # 3. Рассчитываем аспекты между всеми планетами двух карт
-        for obj1 in person1_chart.objects:
-            # Используем только основные объекты для синастрии, чтобы избежать избыточности
-            if obj1.id not in (PLANET_IDS + ANGLE_IDS):
-                continue
-            
-            for obj2 in person2_chart.objects:
-                if obj2.id not in (PLANET_IDS + ANGLE_IDS):
-                    continue
-
-                distance = abs(obj1.lon - obj2.lon)
-                if distance > 180:
-                    distance = 360 - distance
-
-                # Используем стандартные орбисы для синастрии (можно настроить)
-                for aspect_type, max_orb in TRANSIT_ORBS.items():
-                    if aspect_type == const.NO_ASPECT:
-                        continue
-
-                    # Рассчитываем точный угол для каждого аспекта
-                    if aspect_type == const.CONJUNCTION:
-                        exact_angle = 0
-                    elif aspect_type == const.OPPOSITION:
-                        exact_angle = 180
-                    elif aspect_type == const.SQUARE:
-                        exact_angle = 90
-                    elif aspect_type == const.TRINE:
-                        exact_angle = 120
-                    elif aspect_type == const.SEXTILE:
-                        exact_angle = 60
-                    else:
-                        continue
-
-                    orb = abs(distance - exact_angle)
-                    if orb <= max_orb:
-                        aspect_name = ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}")
-                        synastry_aspects.append({
-                            'person1_object': obj1.id,
-                            'aspect': aspect_name,
-                            'person2_object': obj2.id,
-                            'orb': round(orb, 2),
-                        })
-
-        return {"synastry_aspects": synastry_aspects}
-
+        person1_data, person2_data = request.person1.dict(), request.person2.dict()
+        # Синастрия не кэшируется в памяти, но сохраняется в хранилище по ключам обеих карт
+        key = (natal_key(person1_data), natal_key(person2_data))
+        synastry_aspects = await asyncio.to_thread(result_store.get, "synastry", key)
+        if synastry_aspects is None:
+            person1 = await get_natal_entry(person1_data)
+            person2 = await get_natal_entry(person2_data)
+            synastry_aspects = await run_compute(compute_synastry, person1.objects, person2.objects)
+            await asyncio.to_thread(result_store.put, "synastry", key, synastry_aspects)
+        return json_response({"synastry_aspects": synastry_aspects})
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in synastry: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="An internal error occurred while processing synastry.")
 
+@app.post("/synastry/matrix", response_model=SynastryMatrixResponse)
+async def synastry_matrix(request: SynastryMatrixRequest):
+    """
+    Попарная синастрия для группы профилей: матрица оценок совместимости N x N
+    и списки аспектов для top_k лучших партнёров каждого профиля.
+    """
+    try:
+        count = len(request.profiles)
+        if count > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Too many profiles (max {BATCH_MAX_ITEMS})")
+        if request.top_k is None and count > SYNASTRY_FULL_MAX:
+            raise HTTPException(status_code=400, detail=f"Specify top_k for groups larger than {SYNASTRY_FULL_MAX} profiles")
+
+        profiles = [profile.dict() for profile in request.profiles]
+        entries = await get_natal_entries(profiles)
+        objects_list = []
+        for n, natal_data in enumerate(profiles):
+            entry, error = entries[natal_key(natal_data)]
+            if error is not None:
+                raise HTTPException(status_code=400, detail=f"Profile {n}: {error}")
+            objects_list.append(entry.objects)
+
+        from synastry import compute_synastry_matrix
+        return json_response(await run_compute(compute_synastry_matrix, objects_list, request.top_k))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in synastry_matrix: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while processing synastry matrix.")
+
+async def batch_natal_outcomes(validated: List[tuple]) -> List[tuple]:
+    """Натальные карты для проверенных элементов пакета: [(результат, ошибка)]."""
+    entries = await get_natal_entries([data for data, error in validated if error is None])
+
+    outcomes = []
+    for data, error in validated:
+        if error is None:
+            entry, error = entries[natal_key(data)]
+            outcomes.append((entry.result if entry else None, error))
+        else:
+            outcomes.append((None, error))
+    return outcomes
+
+async def batch_transit_outcomes(validated: List[tuple]) -> List[tuple]:
+    """
+    Транзиты для проверенных элементов пакета: [(результат, ошибка)].
+
+    Натальные карты и транзитные положения считаются один раз для каждого
+    уникального субъекта и момента.
+    """
+    validated = list(validated)
+    jds = []
+    for n, (data, error) in enumerate(validated):
+        if error is not None:
+            jds.append(None)
+            continue
+        try:
+            jds.append(transit_jd(data['target_date'], data['tz']))
+        except Exception as e:
+            validated[n] = (None, str(e))
+            jds.append(None)
+
+    entries = await get_natal_entries([data for data, error in validated if error is None])
+    positions = await get_transit_positions_batch([jd for jd in jds if jd is not None])
+
+    # Собираем уникальные задачи (субъект, момент) для поиска аспектов
+    pending, jobs = [], {}
+    for (data, error), jd in zip(validated, jds):
+        if error is None:
+            key = (natal_key(data), jd)
+            entry, error = entries[key[0]]
+            transit_objects, transit_error = positions[jd]
+            error = error or transit_error
+            if error is None and key not in jobs:
+                jobs[key] = (data, data['target_date'], entry.objects, transit_objects)
+        pending.append((data, jd, error))
+
+    matched = dict(zip(jobs, await run_batch_compute(get_transits_for_date, list(jobs.values()))))
+
+    outcomes = []
+    for data, jd, error in pending:
+        if error is not None:
+            outcomes.append((None, error))
+            continue
+        transits, error = matched[(natal_key(data), jd)]
+        outcomes.append(({"target_date": data['target_date'], "transits": transits} if error is None else None, error))
+    return outcomes
+
+async def iter_batch(validated: List[tuple], resolve):
+    """
+    Пакет частями по STREAM_BATCH_SIZE элементов: каждая часть считается
+    целиком и сразу отдаётся клиенту, так что память не растёт с размером пакета.
+    """
+    for offset in range(0, len(validated), STREAM_BATCH_SIZE):
+        outcomes = await resolve(validated[offset:offset + STREAM_BATCH_SIZE])
+        for index, outcome in enumerate(outcomes, offset):
+            yield batch_item(index, outcome)
+
+@app.post("/batch/natal", response_model=BatchNatalResponse)
+async def batch_natal(items: List[Dict[str, Any]], http_request: Request):
+    """
+    Пакетный расчет натальных карт (массив NatalChartOptionsRequest).
+
+    Одинаковые субъекты считаются один раз; ошибки возвращаются по элементам.
+    """
+    try:
+        validated = validate_batch(items, NatalChartOptionsRequest)
+        media_type = stream_media_type(http_request)
+        if media_type:
+            return stream_response(iter_batch(validated, batch_natal_outcomes), media_type)
+        return batch_response(await batch_natal_outcomes(validated))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in batch_natal: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while processing batch.")
+
+@app.post("/batch/transits", response_model=BatchTransitsResponse)
+async def batch_transits(items: List[Dict[str, Any]], http_request: Request):
+    """
+    Пакетный расчет ежедневных транзитов (массив DailyPredictionRequest).
+
+    Ошибки возвращаются по элементам.
+    """
+    try:
+        validated = validate_batch(items, DailyPredictionRequest)
+        media_type = stream_media_type(http_request)
+        if media_type:
+            return stream_response(iter_batch(validated, batch_transit_outcomes), media_type)
+        return batch_response(await batch_transit_outcomes(validated))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in batch_transits: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while processing batch.")
+
+# --- Календарь транзитов (см. transit_calendar.py) ---
+def local_midnight_jd(day, tz: str) -> float:
+    return Datetime(day.strftime("%Y/%m/%d"), '00:00:00', tz).jd
+
+def profile_today(profile: Profile):
+    """Сегодняшняя дата в часовом поясе профиля."""
+    offset = utcoffset_minutes(profile.natal['tz'])
+    return datetime.now(timezone(timedelta(minutes=offset))).date()
+
+async def refresh_calendar(profile: Profile) -> Optional[Profile]:
+    """
+    Сдвигает окно профиля так, чтобы оно начиналось сегодня.
+
+    Если окно ещё не рассчитано, устарело целиком или построено по другой
+    таблице аспектов, оно рассчитывается заново; иначе досчитывается только хвост.
+    Одновременные обновления одного профиля с теми же данными рождения (фоновое
+    и запросы /calendar) выполняются один раз. Возвращает профиль из базы
+    (None, если его удалили); если данные рождения изменились во время расчёта,
+    окно остаётся пустым до обновления по новым данным.
+    """
+    key = (profile.profile_id, natal_key(profile.natal))
+    return await calendar_flights.do(key, lambda: refresh_calendar_window(profile))
+
+async def refresh_calendar_window(profile: Profile) -> Optional[Profile]:
+    # Окно могло сдвинуть только что завершившееся обновление: берём профиль из базы
+    profile = await asyncio.to_thread(calendar_store.get_profile, profile.profile_id)
+    if profile is None:
+        return None
+    start_jd = local_midnight_jd(profile_today(profile), profile.natal['tz'])
+    end_jd = start_jd + CALENDAR_DAYS
+    entry = await get_natal_entry(profile.natal)
+
+    if (profile.tag != INDEX_TAG or profile.window_end is None
+            or not profile.window_start <= start_jd < profile.window_end):
+        events = await run_compute(scan_transits, entry.objects, start_jd, end_jd)
+        await asyncio.to_thread(calendar_store.replace_window, profile.profile_id, profile.natal,
+                                events, start_jd, end_jd)
+    elif end_jd > profile.window_end:
+        events = await run_compute(scan_transits, entry.objects, profile.window_end, end_jd)
+        await asyncio.to_thread(calendar_store.extend_window, profile.profile_id, events,
+                                profile.window_end, start_jd, end_jd)
+    else:
+        return profile
+    return await asyncio.to_thread(calendar_store.get_profile, profile.profile_id)
+
+async def refresh_calendars_periodically():
+    """Фоновая задача: раз в CALENDAR_REFRESH секунд сдвигает окна всех профилей."""
+    while True:
+        for profile in await asyncio.to_thread(calendar_store.list_profiles):
+            try:
+                await refresh_calendar(profile)
+            except Exception as e:
+                logging.error(f"Error refreshing calendar for profile {profile.profile_id}: {e}")
+        await asyncio.sleep(CALENDAR_REFRESH)
+
+def profile_response(profile: Profile) -> Dict[str, Any]:
+    offset = utcoffset_minutes(profile.natal['tz'])
+    window = {}
+    if profile.window_start is not None:
+        window = {"window_start": jd_to_iso(profile.window_start, offset)[:10],
+                  "window_end": jd_to_iso(profile.window_end, offset)[:10]}
+    return {"profile_id": profile.profile_id, **window}
+
+@app.put("/calendar/profiles/{profile_id}", response_model=CalendarProfileResponse)
+async def put_calendar_profile(profile_id: str, request: NatalChartRequest):
+    """
+    Регистрирует (или обновляет) профиль календаря и рассчитывает его окно.
+    """
+    try:
+        if utcoffset_minutes(request.tz) is None:
+            raise HTTPException(status_code=400, detail=f"Invalid time zone: {request.tz}")
+        profile = Profile(profile_id, request.dict(), None, None, None)
+        await asyncio.to_thread(calendar_store.put_profile, profile_id, profile.natal)
+        # Обновление по старым данным рождения, если оно ещё идёт, сюда не подмешивается:
+        # расчёты объединяются по профилю и данным рождения
+        profile = await refresh_calendar(profile)
+        if profile is None:
+            raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+        return profile_response(profile)
+    except HTTPException:
+        raise
+    except sqlite3.OperationalError as e:
+        # База календаря занята другим процессом дольше BUSY_TIMEOUT
+        logging.warning(f"Calendar database is busy in put_calendar_profile: {e}")
+        raise HTTPException(status_code=503, detail="The calendar is busy, please retry later",
+                            headers={"Retry-After": str(executor.retry_after)})
+    except Exception as e:
+        logging.error(f"Error in put_calendar_profile: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while registering the profile.")
+
+@app.get("/calendar/profiles", response_model=List[CalendarProfileResponse])
+def list_calendar_profiles():
+    """Зарегистрированные профили и их окна."""
+    return [profile_response(profile) for profile in calendar_store.list_profiles()]
+
+@app.delete("/calendar/profiles/{profile_id}")
+def delete_calendar_profile(profile_id: str):
+    """Удаляет профиль и его индекс транзитов."""
+    if not calendar_store.delete_profile(profile_id):
+        raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+    return {"profile_id": profile_id, "deleted": True}
+
+@app.get("/calendar/{profile_id}", response_model=CalendarDayResponse)
+async def get_calendar_day(profile_id: str, date: Optional[str] = None):
+    """
+    Транзиты профиля на сутки date (YYYY-MM-DD, по умолчанию сегодня) из индекса.
+    """
+    try:
+        profile = await asyncio.to_thread(calendar_store.get_profile, profile_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+
+        tz = profile.natal['tz']
+        day = (datetime.strptime(date.replace("/", "-"), "%Y-%m-%d").date() if date
+               else profile_today(profile))
+        day_start = local_midnight_jd(day, tz)
+        day_end = local_midnight_jd(day + timedelta(days=1), tz)
+
+        # Окно сдвигается в фоне; если запрос пришёл раньше, сдвигаем его здесь
+        if profile.window_end is None or day_end > profile.window_end or day_start < profile.window_start:
+            profile = await refresh_calendar(profile)
+            if profile is None:
+                raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+            if profile.window_end is None:
+                # Профиль изменили во время расчёта, окно по новым данным ещё строится
+                raise HTTPException(status_code=503, detail="The calendar is being rebuilt, please retry later",
+                                    headers={"Retry-After": str(executor.retry_after)})
+        if not (profile.window_start <= day_start and day_end <= profile.window_end):
+            window = profile_response(profile)
+            raise HTTPException(status_code=400, detail=f"Date is outside the calendar window "
+                                                        f"({window['window_start']} .. {window['window_end']})")
+
+        offset = utcoffset_minutes(tz)
+        events = await asyncio.to_thread(calendar_store.events_between, profile_id, day_start, day_end)
+        return json_response({"profile_id": profile_id, "date": day.isoformat(),
+                              "transits": [format_event(event, offset) for event in events]})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.OperationalError as e:
+        # База календаря занята другим процессом дольше BUSY_TIMEOUT
+        logging.warning(f"Calendar database is busy in get_calendar_day: {e}")
+        raise HTTPException(status_code=503, detail="The calendar is busy, please retry later",
+                            headers={"Retry-After": str(executor.retry_after)})
+    except Exception as e:
+        logging.error(f"Error in get_calendar_day: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An internal error occurred while reading the calendar.")
+
+@app.get('/cache/stats')
+def cache_stats():
+    """Счётчики попаданий, промахов и вытеснений кэшей карт и транзитов и постоянного хранилища."""
+    stats = {cache.name: cache.stats() for cache in (natal_cache, transit_cache)}
+    stats["store"] = result_store.stats()
+    return stats
+
+@app.get('/metrics')
+def get_metrics():
+    """Метрики в формате Prometheus: запросы, задержки, этапы расчёта, кэши и очередь пула."""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get('/ready')
+def readiness_check():
+    """
+    Готовность к расчётам: воркеры пула запущены и эфемериды загружены.
+    До окончания прогрева — 503 (в отличие от /health, который отвечает сразу).
+    """
+    if readiness["status"] != "ready":
+        raise HTTPException(status_code=503, detail=readiness,
+                            headers={"Retry-After": str(executor.retry_after)})
+    return readiness
+
 @app.get('/health')
 def health_check():
     """Проверка работоспособности сервера."""
@@ -0,0 +1,223 @@
+"""
+Метрики в формате Prometheus и замеры этапов расчёта.
+
+Счётчики и гистограммы хранятся в памяти главного процесса и отдаются
+эндпоинтом /metrics в текстовом формате Prometheus (без сторонних
+библиотек). Этапы расчёта (разбор даты и места, построение карты, дома,
+аспекты, сериализация) выполняются в воркерах пула, поэтому их длительности
+собираются там через stage() и возвращаются вместе с результатом задачи
+(timed_call), а главный процесс записывает их в гистограмму и, если включено,
+в заголовок ответа Server-Timing.
+
+Настройки задаются переменными окружения:
+  FLATLIB_SERVER_TIMING — 1, чтобы добавлять заголовок Server-Timing к ответам (по умолчанию 0)
+
+При запуске uvicorn с несколькими процессами (--workers) у каждого процесса
+свои метрики.
+"""
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+SERVER_TIMING = os.getenv("FLATLIB_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+# Границы корзин гистограмм, секунды
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        # Счётчик без меток виден в /metrics с нуля, до первого события
+        self._values: Dict[tuple, float] = {} if labelnames else {(): 0.0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                    for labels, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, суммой и числом наблюдений."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (math.inf,)
+        # labels -> [счётчики корзин..., сумма, число наблюдений]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[n] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (_format_value(bound),))} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{label_str} {state[-1]}")
+        return lines
+
+
+# Сборщик: функция без аргументов, возвращающая
+# [(имя, тип, описание, [(метки, значение)])] на момент запроса /metrics
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    label_str = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_str} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUESTS = REGISTRY.register(Counter(
+    "flatlib_http_requests_total", "HTTP requests by endpoint and status code.",
+    ("method", "endpoint", "status")))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "flatlib_http_request_duration_seconds", "Time until the response headers are sent, by endpoint.",
+    ("method", "endpoint")))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "flatlib_stage_duration_seconds", "Duration of calculation stages.",
+    ("stage",), buckets=STAGE_BUCKETS))
+EXECUTOR_REJECTED = REGISTRY.register(Counter(
+    "flatlib_executor_rejected_total", "Calculations rejected because the compute queue was full."))
+EXECUTOR_TIMEOUTS = REGISTRY.register(Counter(
+    "flatlib_executor_timeouts_total", "Calculations that exceeded the timeout."))
+
+
+# --- Замеры этапов (в воркере) ---
+_local = threading.local()
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет этап расчёта; вне timed_call ничего не записывает."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = getattr(_local, "stages", None)
+        if stages is not None:
+            stages.append((name, time.perf_counter() - start))
+
+
+def timed_call(fn, *args):
+    """Задача для пула: выполняет fn(*args) и возвращает (результат, [(этап, секунды)])."""
+    _local.stages = stages = []
+    start = time.perf_counter()
+    try:
+        result = fn(*args)
+    finally:
+        _local.stages = None
+    stages.append(("task", time.perf_counter() - start))
+    return result, stages
+
+
+# --- Запись этапов (в главном процессе) ---
+# Этапы текущего запроса для заголовка Server-Timing (список задаёт middleware)
+_request_stages: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_stages", default=None)
+
+
+def record_stages(stages: List[Tuple[str, float]]):
+    """Записывает этапы задачи в гистограмму и в этапы текущего запроса."""
+    for name, seconds in stages:
+        STAGE_LATENCY.observe(seconds, name)
+    request_stages = _request_stages.get()
+    if request_stages is not None:
+        request_stages.extend(stages)
+
+
+def start_request() -> list:
+    """Начинает сбор этапов для запроса; возвращает список, в который они попадут."""
+    stages = []
+    _request_stages.set(stages)
+    return stages
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    """Значение заголовка Server-Timing: суммарная длительность каждого этапа в миллисекундах."""
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
@@ -0,0 +1,84 @@
+"""
+Вторичные прогрессии: аспекты прогрессивных планет к натальным.
+
+Прогрессивная карта на возраст N лет — положения планет через N суток
+после рождения («сутки за год»). Натальная карта строится один раз (и
+берётся из кэша), прогрессивные долготы для всех запрошенных возрастов
+считаются одним векторным запросом на тело (см. ephemeris.body_positions),
+а аспекты с орбом 1° ищутся одной матрицей для всех возрастов сразу.
+"""
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from flatlib import const
+from flatlib.datetime import Datetime
+
+from aspects import AspectTable, aspect_motion, find_aspects
+from charts import PLANET_IDS, ASPECT_NAMES, round_days
+from ephemeris import body_positions
+from metrics import stage
+from scan import jd_to_iso
+
+# Прогрессивные тела (Syzygy и Pars Fortuna не движутся непрерывно)
+PROGRESSED_OBJECTS = PLANET_IDS + [const.NORTH_NODE, const.SOUTH_NODE]
+
+# Для прогрессий берутся только мажорные аспекты с орбом 1°
+PROGRESSION_ORB = 1.0
+PROGRESSION_ASPECTS = AspectTable({
+    const.CONJUNCTION: PROGRESSION_ORB,
+    const.OPPOSITION: PROGRESSION_ORB,
+    const.SQUARE: PROGRESSION_ORB,
+    const.TRINE: PROGRESSION_ORB,
+    const.SEXTILE: PROGRESSION_ORB,
+}, minor=False)
+
+
+def birth_jd(natal_data: dict) -> float:
+    """Юлианский день момента рождения."""
+    return Datetime(natal_data['date'].replace("-", "/"), natal_data['time'], natal_data['tz']).jd
+
+
+def compute_progressions(natal_data: dict, natal_objects: List[Tuple[str, float, float]],
+                         ages: List[int], utcoffset_minutes: int) -> List[Dict[str, Any]]:
+    """
+    Задача для пула: прогрессивные аспекты для каждого возраста из ages.
+
+    natal_objects — положения натальных объектов (ChartRecord.objects).
+    Скорость прогрессивной планеты в градусах за сутки равна её скорости в
+    градусах за год прогрессии, поэтому years_to_exact считается так же, как
+    days_to_exact у транзитов.
+    """
+    start_jd = birth_jd(natal_data)
+    jds = start_jd + np.asarray(ages, dtype=float)
+
+    with stage("ephemeris"):
+        # lons[возраст, тело], speeds[возраст, тело]
+        lons = np.empty((len(ages), len(PROGRESSED_OBJECTS)))
+        speeds = np.empty_like(lons)
+        for n, obj_id in enumerate(PROGRESSED_OBJECTS):
+            lons[:, n], speeds[:, n] = body_positions(obj_id, jds)
+
+    with stage("aspects"):
+        natal_lons = [obj[1] for obj in natal_objects]
+        found = find_aspects(lons.ravel(), natal_lons, PROGRESSION_ASPECTS)
+        applying, years = aspect_motion(lons.ravel(), speeds.ravel(), natal_lons,
+                                        [0.0] * len(natal_lons), found)
+
+    with stage("serialize"):
+        results = [
+            {"age": age, "progressed_date": jd_to_iso(jd, utcoffset_minutes)[:10], "progressions": []}
+            for age, jd in zip(ages, jds.tolist())
+        ]
+        count = len(PROGRESSED_OBJECTS)
+        for i, j, aspect_type, _, orb, is_applying, years_to_exact in zip(*found, applying, years):
+            age_index, n = divmod(i, count)
+            results[age_index]["progressions"].append({
+                'progressed_planet': PROGRESSED_OBJECTS[n],
+                'aspect': ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}"),
+                'natal_planet': natal_objects[j][0],
+                'orb': round(orb, 2),
+                'is_applying': is_applying,
+                'years_to_exact': round_days(years_to_exact),
+            })
+    return results
@@ -0,0 +1,264 @@
+"""
+Постоянное хранилище результатов расчёта на диске (SQLite).
+
+Кэш в памяти (cache.py) пропадает при перезапуске или обновлении аддона, и
+у каждого процесса uvicorn (--workers) он свой. Хранилище — второй уровень
+за ним: натальные карты (ChartRecord), транзитные положения на момент и
+результаты синастрии сохраняются в базу в /data и переживают перезапуск,
+а все процессы сервера читают и пишут одну базу (режим WAL: чтение не
+блокируется записью).
+
+Ключ записи — вид результата и нормализованные входные данные (те же, что у
+кэша в памяти) плюс тег версии: версии flatlib и Swiss Ephemeris, таблица
+эфемерид, таблицы аспектов и формат хранения. Записи с другим тегом (после
+обновления) удаляются при открытии. Размер базы ограничен: раз в
+TRIM_INTERVAL секунд (фоновая задача сервера, вне запросов) удаляются записи,
+к которым дольше всего не обращались.
+
+Методы синхронные; сервер вызывает их в потоке (asyncio.to_thread), чтобы
+обращения к диску не останавливали цикл событий. Если базу держит на запись
+другой процесс дольше BUSY_TIMEOUT, чтение считается промахом, а запись
+пропускается — результат просто считается заново.
+
+Настройки задаются переменными окружения:
+  FLATLIB_STORE_DB  — путь к базе (по умолчанию results.sqlite3 в /data, если
+                      каталог есть, иначе рядом с модулем)
+  FLATLIB_STORE_MB  — максимальный объём сохранённых результатов в мегабайтах
+                      (по умолчанию 256, 0 — хранилище выключено)
+"""
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+from charts import NATAL_ASPECTS, SYNASTRY_ASPECTS, TRANSIT_ASPECTS
+from ephemeris import TABLE_PATH, USE_TABLE
+from transit_calendar import DATA_DIR
+
+STORE_DB = os.getenv("FLATLIB_STORE_DB", os.path.join(DATA_DIR, "results.sqlite3"))
+STORE_MB = float(os.getenv("FLATLIB_STORE_MB", 256))
+
+# Меняется, когда меняется формат сохраняемых результатов (ChartRecord, ответы)
+# или нормализация ключей (charts.natal_key)
+# 2: ключи больше не объединяют tz вида '+0530' с '+05:30' — старые записи могли быть неверными
+STORE_FORMAT = 2
+# При превышении лимита удаляются старые записи, пока объём не станет меньше этой доли лимита
+EVICT_TO = 0.9
+# Время последнего обращения обновляется не чаще, чем раз в столько секунд,
+# чтобы чтение из хранилища не превращалось в запись
+TOUCH_INTERVAL = 3600
+# Как часто проверяется размер базы, в секундах
+TRIM_INTERVAL = 60
+# Сколько ждать блокировки базы в запросе, в секундах; при открытии ждём дольше
+BUSY_TIMEOUT = 0.2
+OPEN_TIMEOUT = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    kind     TEXT NOT NULL,
+    key      TEXT NOT NULL,
+    tag      TEXT NOT NULL,
+    value    BLOB NOT NULL,
+    size     INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS results_by_accessed ON results (accessed);
+"""
+
+
+def version_tag() -> str:
+    """Тег версии расчёта: результаты с другим тегом считаются устаревшими."""
+    from importlib import metadata
+
+    import swisseph
+
+    try:
+        flatlib_version = metadata.version("flatlib")
+    except metadata.PackageNotFoundError:
+        flatlib_version = "unknown"
+    if USE_TABLE and os.path.exists(TABLE_PATH):
+        stat = os.stat(TABLE_PATH)
+        ephemeris = f"table:{stat.st_size}:{int(stat.st_mtime)}"
+    else:
+        ephemeris = "live"
+    aspects = ";".join(
+        ",".join(f"{t}:{orb:g}" for t, orb in zip(table.types, table.orbs.tolist()))
+        for table in (NATAL_ASPECTS, TRANSIT_ASPECTS, SYNASTRY_ASPECTS))
+    return f"{STORE_FORMAT}|flatlib {flatlib_version}|swisseph {swisseph.version}|{ephemeris}|{aspects}"
+
+
+def store_key(key: Hashable) -> str:
+    """Ключ кэша (кортеж из строк и чисел, см. charts.natal_key) в виде строки для базы."""
+    return json.dumps(key, separators=(",", ":"))
+
+
+class ResultStore:
+    """
+    Результаты расчёта в SQLite, общие для всех процессов сервера.
+
+    Значения сохраняются через pickle: база локальная и пишется только самим
+    сервером. Ошибки базы (диск переполнен, база заблокирована) не ломают
+    запрос: они логируются, и результат просто считается заново.
+    Размер ограничивается вызовом trim(), а не при каждой записи.
+    """
+
+    def __init__(self, path: str = STORE_DB, max_bytes: int = int(STORE_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.tag = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def open(self):
+        if self._db is not None or self.max_bytes <= 0:
+            return
+        try:
+            db = sqlite3.connect(self.path, timeout=OPEN_TIMEOUT, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with db:
+                db.executescript(SCHEMA)
+            self.tag = version_tag()
+            with db:
+                removed = db.execute("DELETE FROM results WHERE tag != ?", (self.tag,)).rowcount
+            self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            db.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+        except sqlite3.Error as e:
+            logging.warning(f"Result store {self.path} is unavailable ({e}), continuing without it")
+            return
+        self._db = db
+        logging.info(f"Result store opened: {self.path}, {self._bytes / 1024 / 1024:.1f} MB"
+                     + (f", {removed} outdated entries removed" if removed else ""))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def get(self, kind: str, key: Hashable) -> Optional[Any]:
+        return self.get_many(kind, [key]).get(key)
+
+    def get_many(self, kind: str, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """Сохранённые результаты для ключей: {ключ: значение} (отсутствующих ключей в ответе нет)."""
+        if self._db is None:
+            return {}
+        by_text = {store_key(key): key for key in keys}
+        if not by_text:
+            return {}
+        found = {}
+        now = time.time()
+        try:
+            with self._lock:
+                texts = list(by_text)
+                # SQLite ограничивает число параметров запроса
+                for start in range(0, len(texts), 500):
+                    part = texts[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, value, accessed FROM results WHERE kind = ? AND key IN "
+                        f"({','.join('?' * len(part))})", [kind] + part).fetchall()
+                    broken, stale = [], []
+                    for text, value, accessed in rows:
+                        # Обрезанная или несовместимая запись — промах, а не ошибка запроса
+                        try:
+                            found[by_text[text]] = pickle.loads(value)
+                        except Exception as e:
+                            self.errors += 1
+                            logging.warning(f"Result store entry {kind} {text} is unreadable ({e!r}), removing it")
+                            broken.append((kind, text))
+                            continue
+                        if accessed < now - TOUCH_INTERVAL:
+                            stale.append((now, kind, text))
+                    if broken:
+                        self._write_quietly("DELETE FROM results WHERE kind = ? AND key = ?", broken)
+                    if stale:
+                        self._write_quietly("UPDATE results SET accessed = ? WHERE kind = ? AND key = ?", stale)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.warning(f"Result store read failed: {e}")
+        self.hits += len(found)
+        self.misses += len(by_text) - len(found)
+        return found
+
+    def _write_quietly(self, sql: str, rows: List[tuple]):
+        # Обновление времени обращения и удаление испорченных записей необязательны:
+        # если база занята, обойдёмся без них (испорченная запись удалится при следующем чтении)
+        try:
+            with self._db:
+                self._db.executemany(sql, rows)
+        except sqlite3.OperationalError:
+            pass
+
+    def put(self, kind: str, key: Hashable, value: Any):
+        self.put_many(kind, {key: value})
+
+    def put_many(self, kind: str, items: Dict[Hashable, Any]):
+        if self._db is None or not items:
+            return
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((kind, store_key(key), self.tag, data, len(data), now))
+        try:
+            with self._lock, self._db:
+                self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._bytes += sum(row[4] for row in rows)
+                self.writes += len(rows)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.warning(f"Result store write failed: {e}")
+
+    def trim(self):
+        """
+        Если база больше лимита, удаляет давно не использованные записи,
+        пока объём не станет меньше EVICT_TO лимита.
+        """
+        if self._db is None:
+            return
+        try:
+            with self._lock, self._db:
+                # Счётчик объёма в памяти приблизителен (другие процессы тоже пишут), поэтому сверяемся с базой
+                self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                excess = self._bytes - int(self.max_bytes * EVICT_TO)
+                if self._bytes <= self.max_bytes:
+                    return
+                victims, freed = [], 0
+                for rowid, size in self._db.execute("SELECT rowid, size FROM results ORDER BY accessed"):
+                    victims.append((rowid,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                self._db.executemany("DELETE FROM results WHERE rowid = ?", victims)
+                self._bytes -= freed
+                self.evictions += len(victims)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.warning(f"Result store trim failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
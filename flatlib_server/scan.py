@@ -0,0 +1,321 @@
+"""
+Поиск транзитов за период: вход в орб, точные аспекты и выход из орба.
+
+Вместо ежедневных срезов каждая транзитная планета проходит период с
+собственным шагом (Луна — часы, медленные планеты — дни), а моменты
+пересечения границ орба и точного аспекта уточняются методом Ньютона по
+долготе и скорости планеты с защитой бисекцией внутри найденного интервала.
+
+Для каждой цели «натальная долгота ± угол аспекта» функция
+g(t) = norm180(lon(t) - цель) непрерывна на шаге, пока планета смещается
+меньше чем на 180°. Точный аспект — корень g(t), граница орба — корни
+g(t) ∓ orb. Смена знака на шаге ловит пересечение даже если планета
+перескакивает окно орба целиком; пропустить можно только двойное
+пересечение внутри одного шага у станции, где планета почти неподвижна.
+"""
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from flatlib import const
+
+from aspects import AspectTable, norm180
+from charts import PLANET_IDS, ASPECT_NAMES, TRANSIT_ASPECTS
+from ephemeris import body_position, body_positions
+from metrics import stage
+
+# Транзитные тела для поиска по периоду (Syzygy и Pars Fortuna не движутся непрерывно)
+SCAN_OBJECTS = PLANET_IDS + [const.NORTH_NODE, const.SOUTH_NODE]
+
+# Максимальная скорость тела, градусов в сутки (для выбора шага)
+MAX_SPEED = {
+    const.SUN: 1.02,
+    const.MOON: 15.4,
+    const.MERCURY: 2.2,
+    const.VENUS: 1.26,
+    const.MARS: 0.8,
+    const.JUPITER: 0.25,
+    const.SATURN: 0.13,
+    const.NORTH_NODE: 0.25,
+    const.SOUTH_NODE: 0.25,
+}
+# За один шаг тело смещается не больше чем на MAX_MOVE градусов и не дольше MAX_STEP суток
+MAX_MOVE = 6.0
+MAX_STEP = 5.0
+
+# Точность уточнения корня: ~1 секунда времени
+TIME_TOLERANCE = 1.0 / 86400
+MAX_ITERATIONS = 40
+
+J2000 = 2451545.0
+J2000_DATETIME = datetime(2000, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def step_for(obj_id: str) -> float:
+    """Шаг сканирования в сутках для тела."""
+    return min(MAX_MOVE / MAX_SPEED[obj_id], MAX_STEP)
+
+
+def find_root(obj_id: str, target: float, offset: float, a: float, b: float,
+              fa: float, fb: float) -> float:
+    """
+    Момент t в [a, b], где norm180(lon(t) - target) == offset.
+
+    fa и fb — значения функции на концах, разных знаков. Шаг Ньютона по
+    скорости тела; если он выходит за интервал, делается шаг бисекции.
+    """
+    t = a - fa * (b - a) / (fb - fa)
+    for _ in range(MAX_ITERATIONS):
+        lon, speed = body_position(obj_id, t)
+        f = norm180(lon - target) - offset
+        if f == 0.0:
+            return t
+        if (f < 0) == (fa < 0):
+            a, fa = t, f
+        else:
+            b, fb = t, f
+        if b - a < TIME_TOLERANCE:
+            break
+        t_next = t - f / speed if speed else a - 1.0
+        if not a < t_next < b:
+            t_next = (a + b) / 2
+        if abs(t_next - t) < TIME_TOLERANCE:
+            return t_next
+        t = t_next
+    return a - fa * (b - a) / (fb - fa)
+
+
+def find_roots(obj_id: str, targets: np.ndarray, offsets: np.ndarray, a: np.ndarray, b: np.ndarray,
+               fa: np.ndarray, fb: np.ndarray) -> np.ndarray:
+    """
+    Векторная версия find_root: корни для массива интервалов одного тела.
+
+    Все интервалы уточняются одновременно, положения тела на каждой итерации
+    берутся одним вызовом body_positions. Сошедшиеся интервалы выбывают.
+    """
+    a, b, fa, fb = (np.array(x, dtype=float) for x in (a, b, fa, fb))
+    t = a - fa * (b - a) / (fb - fa)
+    active = np.arange(len(t))
+    for _ in range(MAX_ITERATIONS):
+        if not len(active):
+            break
+        ta = t[active]
+        lon, speed = body_positions(obj_id, ta)
+        f = norm180(lon - targets[active]) - offsets[active]
+        same = (f < 0) == (fa[active] < 0)
+        a[active] = np.where(same, ta, a[active])
+        fa[active] = np.where(same, f, fa[active])
+        b[active] = np.where(same, b[active], ta)
+        fb[active] = np.where(same, fb[active], f)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_next = ta - f / speed
+        inside = (a[active] < t_next) & (t_next < b[active])
+        t_next = np.where(inside, t_next, (a[active] + b[active]) / 2)
+        done = (f == 0.0) | (np.abs(t_next - ta) < TIME_TOLERANCE) | (b[active] - a[active] < TIME_TOLERANCE)
+        t[active] = np.where(f == 0.0, ta, t_next)
+        active = active[~done]
+    return t
+
+
+def find_brackets(g: np.ndarray, offset=0.0):
+    """
+    Шаги сетки, на которых g - offset меняет знак: (шаги, индексы целей, g - offset).
+
+    g[шаг, цель] = norm180(lon(times[шаг]) - долгота цели); offset — число или
+    массив по целям.
+    """
+    h = g - offset
+    sign = h >= 0
+    # Шаги, на которых g перескакивает через ±180, не содержат корней рядом с нулём
+    continuous = np.abs(np.diff(g, axis=0)) < 180
+    steps, cols = np.nonzero((sign[:-1] != sign[1:]) & continuous)
+    return steps, cols, h
+
+
+def find_crossings(obj_id: str, times: np.ndarray, g: np.ndarray, target_lons: np.ndarray,
+                   offset=0.0) -> List[Tuple[int, float, bool]]:
+    """
+    Моменты, когда тело проходит долготы target_lons (со сдвигом offset).
+
+    Возвращает (индекс цели, момент, прямое ли движение) для каждой смены
+    знака g - offset между соседними узлами сетки (см. find_brackets).
+    """
+    steps, cols, h = find_brackets(g, offset)
+    sign = h >= 0
+    roots = []
+    for s, c in zip(steps.tolist(), cols.tolist()):
+        off = float(offset[c]) if np.ndim(offset) else offset
+        t = find_root(obj_id, float(target_lons[c]), off, float(times[s]), float(times[s + 1]),
+                      float(h[s, c]), float(h[s + 1, c]))
+        roots.append((c, t, bool(sign[s + 1, c])))
+    return roots
+
+
+def aspect_targets(natal_objects: List[Tuple[str, float, float]], table: AspectTable):
+    """
+    Цели для поиска: (индекс натального объекта, индекс аспекта, долгота цели).
+
+    Для аспекта с углом A цели natal + A и natal - A (для 0° и 180° — одна).
+    """
+    targets = []
+    for j, (_, natal_lon, _) in enumerate(natal_objects):
+        for k, angle in enumerate(table.angles.tolist()):
+            for side in dict.fromkeys((angle % 360.0, -angle % 360.0)):
+                targets.append((j, k, (natal_lon + side) % 360.0))
+    return targets
+
+
+def scan_body(obj_id: str, natal_objects: List[Tuple[str, float, float]], start_jd: float,
+              end_jd: float, table: AspectTable) -> List[Dict[str, Any]]:
+    """Все прохождения одного транзитного тела через орбы натальных аспектов за период."""
+    targets = [t for t in aspect_targets(natal_objects, table) if natal_objects[t[0]][0] != obj_id]
+    if not targets:
+        return []
+
+    count = max(int(np.ceil((end_jd - start_jd) / step_for(obj_id))), 1)
+    times = np.linspace(start_jd, end_jd, count + 1)
+    lons = body_positions(obj_id, times)[0]
+
+    target_lons = np.array([t[2] for t in targets])
+    orbs = table.orbs[[t[1] for t in targets]]
+    g = norm180(lons[:, None] - target_lons[None, :])
+
+    # Все пересечения: (цель, момент, вид), вид 0 — точный аспект, ±1 — граница орба
+    crossings = []
+    for kind, offset in ((0, 0.0), (1, orbs), (-1, -orbs)):
+        crossings.extend((c, t, kind) for c, t, _ in find_crossings(obj_id, times, g, target_lons, offset))
+    crossings.sort()
+
+    events = []
+    inside = np.abs(g[0]) <= orbs
+    current = {c: _new_event(obj_id, natal_objects, targets, c, table, None)
+               for c in np.nonzero(inside)[0].tolist()}
+    for c, t, kind in crossings:
+        if kind == 0:
+            if c not in current:
+                # Точный аспект без зафиксированного входа (граница совпала с узлом сетки)
+                current[c] = _new_event(obj_id, natal_objects, targets, c, table, None)
+            current[c]['exact'].append(t)
+        elif c in current:
+            event = current.pop(c)
+            event['exit'] = t
+            events.append(event)
+        else:
+            current[c] = _new_event(obj_id, natal_objects, targets, c, table, t)
+    events.extend(current.values())
+
+    for event in events:
+        c = event['_key'][1]
+        if event['exact']:
+            event['orb'] = 0.0
+        else:
+            # Аспект не дошёл до точного: ближайший орб по узлам сетки внутри интервала
+            lo = event['entry'] if event['entry'] is not None else start_jd
+            hi = event['exit'] if event['exit'] is not None else end_jd
+            within = (times >= lo) & (times <= hi)
+            closest = np.abs(g[within, c]).min() if within.any() else float(orbs[c])
+            event['orb'] = round(float(closest), 2)
+    return events
+
+
+def _new_event(obj_id, natal_objects, targets, c, table, entry):
+    j, k, _ = targets[c]
+    aspect_type = table.types[k]
+    return {
+        'transit_planet': obj_id,
+        'aspect': ASPECT_NAMES.get(aspect_type, f"Unknown-{aspect_type}"),
+        'natal_planet': natal_objects[j][0],
+        'entry': entry,
+        'exact': [],
+        'exit': None,
+        # Идентификатор цели: по нему склеиваются части одного прохождения (TimelineStitcher)
+        '_key': (obj_id, c),
+    }
+
+
+def scan_transits(natal_objects: List[Tuple[str, float, float]], start_jd: float, end_jd: float,
+                  table: AspectTable = TRANSIT_ASPECTS) -> List[Dict[str, Any]]:
+    """
+    Транзитные аспекты за период [start_jd, end_jd] с моментами в юлианских днях.
+
+    entry/exit равны None, если аспект уже в орбе в начале периода или ещё
+    в орбе в конце. События отсортированы по времени начала.
+    """
+    events = []
+    with stage("scan"):
+        for obj_id in SCAN_OBJECTS:
+            events.extend(scan_body(obj_id, natal_objects, start_jd, end_jd, table))
+    events.sort(key=lambda e: (e['entry'] if e['entry'] is not None else start_jd,
+                               e['exact'][0] if e['exact'] else end_jd))
+    return events
+
+
+@lru_cache(maxsize=None)
+def _local_j2000(utcoffset_minutes: int) -> datetime:
+    return J2000_DATETIME.astimezone(timezone(timedelta(minutes=utcoffset_minutes)))
+
+
+def jd_to_iso(jd: Optional[float], utcoffset_minutes: int) -> Optional[str]:
+    """Юлианский день -> ISO 8601 в заданном часовом поясе (с точностью до секунды)."""
+    if jd is None:
+        return None
+    moment = _local_j2000(utcoffset_minutes) + timedelta(days=jd - J2000)
+    return moment.replace(microsecond=0).isoformat()
+
+
+def format_event(event: Dict[str, Any], utcoffset_minutes: int) -> Dict[str, Any]:
+    """Событие для ответа API: моменты в ISO 8601, без служебных полей."""
+    return {
+        'transit_planet': event['transit_planet'],
+        'aspect': event['aspect'],
+        'natal_planet': event['natal_planet'],
+        'entry': jd_to_iso(event['entry'], utcoffset_minutes),
+        'exact': [jd_to_iso(t, utcoffset_minutes) for t in event['exact']],
+        'exit': jd_to_iso(event['exit'], utcoffset_minutes),
+        'orb': event['orb'],
+    }
+
+
+def compute_transit_period(natal_objects: List[Tuple[str, float, float]], start_jd: float,
+                           end_jd: float, utcoffset_minutes: int) -> List[Dict[str, Any]]:
+    """Задача для пула: события транзитов за период с датами в часовом поясе запроса."""
+    return [format_event(event, utcoffset_minutes)
+            for event in scan_transits(natal_objects, start_jd, end_jd)]
+
+
+class TimelineStitcher:
+    """
+    Склеивает события, посчитанные по частям длинного периода.
+
+    Прохождение, которое не закончилось в одной части (exit is None),
+    держится открытым и продолжается событием той же цели без entry в
+    следующей части. В памяти остаются только открытые прохождения, поэтому
+    длина периода на неё не влияет.
+    """
+
+    def __init__(self):
+        self.open: Dict[tuple, Dict[str, Any]] = {}
+
+    def feed(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Принимает события очередной части, возвращает завершившиеся прохождения."""
+        closed = []
+        for event in events:
+            previous = self.open.pop(event['_key'], None) if event['entry'] is None else None
+            if previous is not None:
+                previous['exact'].extend(event['exact'])
+                previous['exit'] = event['exit']
+                previous['orb'] = min(previous['orb'], event['orb'])
+                event = previous
+            if event['exit'] is None:
+                self.open[event['_key']] = event
+            else:
+                closed.append(event)
+        return closed
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Прохождения, которые ещё в орбе в конце периода."""
+        events = sorted(self.open.values(), key=lambda e: e['entry'] if e['entry'] is not None else 0.0)
+        self.open.clear()
+        return events
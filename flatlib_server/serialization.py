@@ -0,0 +1,30 @@
+"""
+Сериализация ответов в JSON сразу в байты.
+
+Если установлен orjson, используется он: он в несколько раз быстрее json и
+сразу возвращает bytes. Без него — стандартный json в том же компактном
+формате, что у FastAPI (UTF-8 без экранирования).
+
+Модуль не зависит от FastAPI: тело ответа /natal сериализуется прямо в воркере
+(см. charts.ChartRecord.json).
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
@@ -0,0 +1,50 @@
+"""
+Объединение одинаковых одновременных расчётов (single flight).
+
+При всплеске одинаковых запросов (например, после перезапуска Home Assistant
+все автоматизации разом спрашивают /natal и /predict/daily для одного
+человека) кэш ещё пуст, и без объединения каждый запрос считал бы карту
+заново. SingleFlight запускает расчёт для ключа один раз, а остальные запросы
+с тем же ключом, пришедшие до его окончания, ждут тот же результат (или ту же
+ошибку). Завершённый расчёт из таблицы удаляется — дальше результат отдаёт кэш.
+
+Расчёт идёт отдельной задачей asyncio: если клиент, запустивший его,
+отключится, остальные ожидающие всё равно получат результат.
+
+Работает в пределах одного процесса (цикла событий) uvicorn. Число
+объединённых запросов отдаётся в /metrics (flatlib_coalesced_requests_total).
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Таблица выполняющихся расчётов: ключ -> задача asyncio."""
+
+    def __init__(self, name: str):
+        self.name = name
+        # Запросы, дождавшиеся чужого расчёта вместо своего
+        self.coalesced = 0
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат compute() для key; одновременные вызовы с тем же key считают его один раз."""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего (отключился клиент) не отменяет общий расчёт
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._flights.pop(key, None)
+        # Если все ожидающие отменены, ошибку никто не заберёт — забираем её здесь,
+        # чтобы asyncio не писал в лог "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
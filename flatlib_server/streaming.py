@@ -0,0 +1,51 @@
+"""
+Потоковая выдача результатов: NDJSON и Server-Sent Events.
+
+Если клиент присылает `Accept: application/x-ndjson` (или `text/event-stream`),
+эндпоинты отдают элементы по мере расчёта, а не собирают весь ответ в памяти.
+Каждый элемент — отдельная строка JSON (или отдельное SSE-событие `data:`).
+Ошибка после начала ответа передаётся последним элементом {"error": "..."},
+так как код статуса уже отправлен.
+"""
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from serialization import dumps
+
+NDJSON = "application/x-ndjson"
+SSE = "text/event-stream"
+
+
+def stream_media_type(request: Request) -> Optional[str]:
+    """Потоковый формат, запрошенный в заголовке Accept, или None для обычного JSON."""
+    accept = request.headers.get("accept", "")
+    for media_type in (NDJSON, SSE):
+        if media_type in accept:
+            return media_type
+    return None
+
+
+def encode_item(item: Dict[str, Any], media_type: str) -> bytes:
+    line = dumps(item)
+    if media_type == SSE:
+        return b"data: " + line + b"\n\n"
+    return line + b"\n"
+
+
+def stream_response(items: AsyncIterator[Dict[str, Any]], media_type: str) -> StreamingResponse:
+    """Оборачивает асинхронный генератор словарей в потоковый ответ."""
+    async def body():
+        try:
+            async for item in items:
+                yield encode_item(item, media_type)
+        except Exception as e:
+            logging.error(f"Error while streaming response: {e}", exc_info=True)
+            yield encode_item({"error": str(getattr(e, "detail", e))}, media_type)
+        if media_type == SSE:
+            yield b"event: end\ndata: {}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
@@ -0,0 +1,164 @@
+"""
+Синастрия для группы: матрица совместимости N x N.
+
+Каждая карта считается один раз (натальный кэш), долготы объектов всех
+профилей склеиваются в один массив, и все N² сравнений идут блоками строк
+по матрице угловых расстояний (aspects.distance_matrix), без циклов по парам.
+
+Оценка совместимости пары — сумма весов найденных аспектов: гармоничные
+(соединение, секстиль, трин) прибавляют, напряжённые (квадрат, оппозиция)
+вычитают; вклад аспекта убывает линейно от 1 при точном аспекте до 0 на
+границе орба и умножается на веса объектов (светила и личные планеты важнее).
+Оценка симметрична: score(i, j) == score(j, i).
+
+Списки аспектов (как у /synastry) строятся только для выбранных пар:
+top_k лучших партнёров каждого профиля или, если top_k не задан, всех пар.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from flatlib import const
+
+from aspects import aspect_motion, distance_matrix, find_aspects
+from charts import SYNASTRY_ASPECTS, SYNASTRY_IDS, motion_speed, synastry_aspect
+from metrics import stage
+
+# Вес аспекта в оценке совместимости (минорные: созвучные +0.5, напряжённые -0.5)
+ASPECT_WEIGHTS = {
+    const.CONJUNCTION: 1.0,
+    const.SEXTILE: 1.0,
+    const.TRINE: 1.0,
+    const.SQUARE: -1.0,
+    const.OPPOSITION: -1.0,
+    const.SEMISEXTILE: 0.5,
+    const.QUINTILE: 0.5,
+    const.BIQUINTILE: 0.5,
+    const.SEMISQUARE: -0.5,
+    const.SESQUISQUARE: -0.5,
+    const.QUINCUNX: -0.5,
+}
+
+# Вес объекта; для пары объектов веса перемножаются
+OBJECT_WEIGHTS = {
+    const.SUN: 2.0,
+    const.MOON: 2.0,
+    const.VENUS: 1.5,
+    const.MARS: 1.5,
+}
+
+# Ограничение на размер блока (пары долгот x типы аспектов), чтобы не держать
+# в памяти всю матрицу N² сразу
+BLOCK_ELEMENTS = 4_000_000
+
+
+def synastry_arrays(objects_list: List[List[Tuple[str, float, float]]]):
+    """
+    Долготы и скорости объектов синастрии для всех профилей: (ids, lons[N, M], speeds[N, M]).
+
+    objects_list — ChartRecord.objects каждого профиля.
+    """
+    ids = [obj[0] for obj in objects_list[0] if obj[0] in SYNASTRY_IDS]
+    lons = np.empty((len(objects_list), len(ids)))
+    speeds = np.empty_like(lons)
+    for n, objects in enumerate(objects_list):
+        by_id = {obj[0]: obj for obj in objects}
+        for m, obj_id in enumerate(ids):
+            _, lons[n, m], speed = by_id[obj_id]
+            speeds[n, m] = motion_speed(obj_id, speed)
+    return ids, lons, speeds
+
+
+def score_matrix(ids: List[str], lons: np.ndarray) -> np.ndarray:
+    """Матрица оценок совместимости N x N (на диагонали NaN)."""
+    count, size = lons.shape
+    table = SYNASTRY_ASPECTS
+    aspect_weights = np.array([ASPECT_WEIGHTS.get(t, 0.0) for t in table.types])
+    object_weights = np.tile([OBJECT_WEIGHTS.get(obj_id, 1.0) for obj_id in ids], count)
+    flat = lons.ravel()
+
+    scores = np.zeros((count, count))
+    rows = max(1, BLOCK_ELEMENTS // (size * size * count * len(table.types)))
+    for start in range(0, count, rows):
+        end = min(count, start + rows)
+        # Матрица симметрична: блок строк [start, end) сравнивается со столбцами от start
+        distance = distance_matrix(flat[start * size:end * size], flat[start * size:])
+        closeness = np.clip(1.0 - np.abs(distance[:, :, None] - table.angles) / table.orbs, 0.0, None)
+        pair = closeness @ aspect_weights
+        pair *= object_weights[start * size:end * size, None] * object_weights[None, start * size:]
+        scores[start:end, start:] = pair.reshape(end - start, size, count - start, size).sum(axis=(1, 3))
+
+    scores = np.triu(scores, k=1)
+    scores += scores.T
+    np.fill_diagonal(scores, np.nan)
+    return scores
+
+
+def select_pairs(scores: np.ndarray, top_k: Optional[int]) -> List[Tuple[int, int]]:
+    """Пары (i, j), i < j: top_k лучших партнёров каждого профиля или все пары."""
+    count = len(scores)
+    if top_k is None or top_k >= count - 1:
+        i, j = np.triu_indices(count, k=1)
+        return list(zip(i.tolist(), j.tolist()))
+
+    # NaN на диагонали сортируется последним, поэтому сам профиль в топ не попадает
+    ranked = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    pairs = set()
+    for i, partners in enumerate(ranked.tolist()):
+        for j in partners:
+            pairs.add((min(i, j), max(i, j)))
+    return sorted(pairs)
+
+
+def pair_aspects(ids: List[str], lons: np.ndarray, speeds: np.ndarray,
+                 pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], List[Dict[str, Any]]]:
+    """
+    Списки аспектов для пар, как у compute_synastry(person1, person2).
+
+    Пары с общим первым профилем обрабатываются одним вызовом find_aspects:
+    его объекты сравниваются с объектами всех его партнёров сразу.
+    """
+    size = len(ids)
+    partners: Dict[int, List[int]] = {}
+    for i, j in pairs:
+        partners.setdefault(i, []).append(j)
+
+    result = {pair: [] for pair in pairs}
+    for i, others in partners.items():
+        other_lons = lons[others].ravel()
+        found = find_aspects(lons[i], other_lons, SYNASTRY_ASPECTS, first_only=False)
+        applying, days = aspect_motion(lons[i], speeds[i], other_lons, speeds[others].ravel(), found)
+        # Порядок find_aspects — по объекту первого профиля, затем по столбцу,
+        # поэтому внутри каждой пары он совпадает с порядком compute_synastry
+        for a, column, aspect_type, _, orb, is_applying, days_to_exact in zip(*found, applying, days):
+            n, b = divmod(column, size)
+            result[(i, others[n])].append(
+                synastry_aspect(ids[a], ids[b], aspect_type, orb, is_applying, days_to_exact))
+    return result
+
+
+def compute_synastry_matrix(objects_list: List[List[Tuple[str, float, float]]],
+                            top_k: Optional[int]) -> Dict[str, Any]:
+    """
+    Задача для пула: матрица оценок совместимости и списки аспектов для выбранных пар.
+
+    Пары в ответе отсортированы по убыванию оценки.
+    """
+    ids, lons, speeds = synastry_arrays(objects_list)
+
+    with stage("aspects"):
+        scores = score_matrix(ids, lons)
+        pairs = select_pairs(scores, top_k)
+        pairs.sort(key=lambda pair: -scores[pair])
+        aspects = pair_aspects(ids, lons, speeds, pairs)
+
+    with stage("serialize"):
+        rounded = np.round(scores, 2).tolist()
+        matrix = [[None if i == j else value for j, value in enumerate(row)] for i, row in enumerate(rounded)]
+        return {
+            "scores": matrix,
+            "pairs": [
+                {"person1": i, "person2": j, "score": rounded[i][j], "synastry_aspects": aspects[(i, j)]}
+                for i, j in pairs
+            ],
+        }
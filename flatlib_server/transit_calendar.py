@@ -0,0 +1,229 @@
+"""
+Календарь транзитов для зарегистрированных профилей.
+
+Для каждого профиля (например, члена семьи в Home Assistant) заранее
+рассчитываются прохождения транзитных аспектов на скользящее окно
+(по умолчанию 90 суток от сегодняшнего дня) и сохраняются в SQLite как
+интервалы: вход в орб, точные моменты, выход. Запрос «транзиты на день»
+становится выборкой интервалов, пересекающих сутки, без расчёта эфемерид.
+
+Окно сдвигается инкрементально: досчитывается только новый хвост периода,
+прохождения, открытые на старой границе окна, склеиваются с продолжением
+(scan.TimelineStitcher), а закончившиеся до начала окна удаляются.
+
+Настройки задаются переменными окружения:
+  FLATLIB_CALENDAR_DB       — путь к базе SQLite (по умолчанию calendar.sqlite3
+                              в /data, если каталог есть, иначе рядом с модулем)
+  FLATLIB_CALENDAR_DAYS     — длина окна в сутках (по умолчанию 90)
+  FLATLIB_CALENDAR_REFRESH  — период фонового сдвига окон в секундах (по умолчанию 3600)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from charts import TRANSIT_ASPECTS
+from scan import TimelineStitcher
+
+DATA_DIR = "/data" if os.path.isdir("/data") else os.path.dirname(os.path.abspath(__file__))
+CALENDAR_DB = os.getenv("FLATLIB_CALENDAR_DB", os.path.join(DATA_DIR, "calendar.sqlite3"))
+CALENDAR_DAYS = float(os.getenv("FLATLIB_CALENDAR_DAYS", 90))
+CALENDAR_REFRESH = float(os.getenv("FLATLIB_CALENDAR_REFRESH", 3600))
+# Сколько ждать блокировки базы, занятой другим процессом сервера, в секундах
+BUSY_TIMEOUT = 0.5
+
+# Ключи прохождений (scan._key) зависят от таблицы аспектов: если она изменилась
+# (например, включены минорные аспекты), индекс профиля строится заново
+INDEX_TAG = ",".join(str(aspect_type) for aspect_type in TRANSIT_ASPECTS.types)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id   TEXT PRIMARY KEY,
+    natal        TEXT NOT NULL,
+    tag          TEXT,
+    window_start REAL,
+    window_end   REAL,
+    updated      REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    profile_id     TEXT NOT NULL,
+    target         TEXT NOT NULL,
+    transit_planet TEXT NOT NULL,
+    aspect         TEXT NOT NULL,
+    natal_planet   TEXT NOT NULL,
+    entry          REAL,
+    exact          TEXT NOT NULL,
+    exit           REAL,
+    orb            REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_exit ON events (profile_id, exit);
+CREATE INDEX IF NOT EXISTS events_by_entry ON events (profile_id, entry);
+"""
+
+
+class Profile(NamedTuple):
+    profile_id: str
+    natal: Dict[str, Any]
+    # Идентификатор таблицы аспектов, по которой построен индекс (см. scan._key)
+    tag: Optional[str]
+    window_start: Optional[float]
+    window_end: Optional[float]
+
+
+def _natal_json(natal: Dict[str, Any]) -> str:
+    """Данные рождения профиля в том виде, в котором они хранятся и сравниваются."""
+    return json.dumps(natal, sort_keys=True)
+
+
+def _event_row(profile_id: str, event: Dict[str, Any]) -> tuple:
+    obj_id, target = event['_key']
+    return (profile_id, f"{obj_id}|{target}", event['transit_planet'], event['aspect'],
+            event['natal_planet'], event['entry'], json.dumps(event['exact']), event['exit'], event['orb'])
+
+
+def _row_event(row: sqlite3.Row) -> Dict[str, Any]:
+    obj_id, target = row['target'].split("|")
+    return {
+        'transit_planet': row['transit_planet'],
+        'aspect': row['aspect'],
+        'natal_planet': row['natal_planet'],
+        'entry': row['entry'],
+        'exact': json.loads(row['exact']),
+        'exit': row['exit'],
+        'orb': row['orb'],
+        '_key': (obj_id, int(target)),
+    }
+
+
+class CalendarStore:
+    """
+    Хранилище профилей и интервального индекса транзитов в SQLite.
+
+    Моменты хранятся в юлианских днях; у прохождения, которое уже шло на
+    начало окна, entry — NULL, у ещё не закончившегося к концу окна exit — NULL.
+
+    Методы синхронные: сервер вызывает их в потоке (asyncio.to_thread). Если
+    базу держит другой процесс дольше BUSY_TIMEOUT, метод выбрасывает
+    sqlite3.OperationalError.
+    """
+
+    def __init__(self, path: str = CALENDAR_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def open(self):
+        if self._db is not None:
+            return
+        self._db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # WAL: чтение индекса не ждёт, пока другой процесс пишет в базу
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # --- Профили ---
+    def put_profile(self, profile_id: str, natal: Dict[str, Any]):
+        """Регистрирует профиль; при изменении данных рождения индекс сбрасывается."""
+        natal_json = _natal_json(natal)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT natal FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+            if row is not None and row['natal'] == natal_json:
+                return
+            self._db.execute("DELETE FROM events WHERE profile_id = ?", (profile_id,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO profiles (profile_id, natal, tag, window_start, window_end, updated) "
+                "VALUES (?, ?, NULL, NULL, NULL, ?)", (profile_id, natal_json, time.time()))
+
+    def get_profile(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+        return self._profile(row) if row is not None else None
+
+    def list_profiles(self) -> List[Profile]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM profiles ORDER BY profile_id").fetchall()
+        return [self._profile(row) for row in rows]
+
+    def delete_profile(self, profile_id: str) -> bool:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM events WHERE profile_id = ?", (profile_id,))
+            return self._db.execute("DELETE FROM profiles WHERE profile_id = ?", (profile_id,)).rowcount > 0
+
+    @staticmethod
+    def _profile(row: sqlite3.Row) -> Profile:
+        return Profile(row['profile_id'], json.loads(row['natal']), row['tag'], row['window_start'], row['window_end'])
+
+    # --- Индекс ---
+    def replace_window(self, profile_id: str, natal: Dict[str, Any], events: List[Dict[str, Any]],
+                       start_jd: float, end_jd: float) -> bool:
+        """
+        Полностью перестраивает индекс профиля по событиям scan.scan_transits за [start_jd, end_jd].
+
+        natal — данные рождения, по которым считались события. Если за время
+        расчёта профиль изменили или удалили, события не записываются, иначе
+        индекс нового профиля заполнился бы транзитами старой карты.
+        Возвращает, был ли индекс перестроен.
+        """
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute("SELECT natal FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+            if row is None or row['natal'] != _natal_json(natal):
+                return False
+            self._db.execute("DELETE FROM events WHERE profile_id = ?", (profile_id,))
+            self._db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [_event_row(profile_id, event) for event in events])
+            self._db.execute("UPDATE profiles SET tag = ?, window_start = ?, window_end = ?, updated = ? "
+                             "WHERE profile_id = ?", (INDEX_TAG, start_jd, end_jd, time.time(), profile_id))
+        return True
+
+    def extend_window(self, profile_id: str, events: List[Dict[str, Any]], scanned_from: float,
+                      start_jd: float, end_jd: float) -> bool:
+        """
+        Сдвигает окно профиля на [start_jd, end_jd].
+
+        events — события за период от старого конца окна scanned_from до end_jd;
+        они склеиваются с прохождениями, открытыми на старой границе.
+        Прохождения, закончившиеся до start_jd, удаляются.
+
+        Если за время расчёта окно уже сдвинул кто-то другой (например, другой
+        процесс сервера), события не записываются, иначе прохождения задвоятся.
+        Возвращает, было ли окно сдвинуто.
+        """
+        with self._lock, self._db:
+            # Блокировка на запись с самого начала: проверка окна и запись — одна транзакция
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute("SELECT window_end FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+            if row is None or row['window_end'] != scanned_from:
+                return False
+            rows = self._db.execute("SELECT * FROM events WHERE profile_id = ? AND exit IS NULL",
+                                    (profile_id,)).fetchall()
+            stitcher = TimelineStitcher()
+            stitcher.feed([_row_event(row) for row in rows])
+            merged = stitcher.feed(events) + stitcher.finish()
+
+            self._db.execute("DELETE FROM events WHERE profile_id = ? AND (exit IS NULL OR exit < ?)",
+                             (profile_id, start_jd))
+            self._db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [_event_row(profile_id, event) for event in merged
+                                  if event['exit'] is None or event['exit'] >= start_jd])
+            self._db.execute("UPDATE profiles SET window_start = ?, window_end = ?, updated = ? "
+                             "WHERE profile_id = ?", (start_jd, end_jd, time.time(), profile_id))
+        return True
+
+    def events_between(self, profile_id: str, start_jd: float, end_jd: float) -> List[Dict[str, Any]]:
+        """Прохождения, пересекающие интервал [start_jd, end_jd), по времени входа."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM events WHERE profile_id = ? "
+                "AND (entry IS NULL OR entry < ?) AND (exit IS NULL OR exit >= ?) "
+                "ORDER BY COALESCE(entry, 0), rowid",
+                (profile_id, end_jd, start_jd)).fetchall()
+        return [_row_event(row) for row in rows]